@@ -0,0 +1,300 @@
+import argparse
+import contextlib
+import functools
+import io
+import json
+import multiprocessing
+import os
+import resource
+import time
+from datetime import datetime
+import psycopg2
+import psycopg2.extensions
+from create_tables import create_database, create_tables, create_foreign_keys, create_indexes
+import etl
+
+# ETL configurations to benchmark, each one maps to the command-line flags of etl.py
+modes = {
+    'row': {},
+    'bulk': {'bulk': True, 'lookup': True, 'time_cache': True, 'song_batch_size': 1000},
+}
+
+
+class CountingCursor(psycopg2.extensions.cursor):
+    """ Cursor that counts the statements sent to the database on its connection. """
+
+    def execute(self, query, vars=None):
+        self.connection.round_trips += 1
+        return super().execute(query, vars)
+
+    def executemany(self, query, vars_list):
+        vars_list = list(vars_list)
+        self.connection.round_trips += len(vars_list)
+        return super().executemany(query, vars_list)
+
+    def copy_expert(self, sql, file, size=8192):
+        self.connection.round_trips += 1
+        return super().copy_expert(sql, file, size)
+
+
+class CountingConnection(psycopg2.extensions.connection):
+    """ Connection that counts the statements and commits sent to the database. """
+
+    round_trips = 0
+
+    def cursor(self, *args, **kwargs):
+        kwargs.setdefault('cursor_factory', CountingCursor)
+        return super().cursor(*args, **kwargs)
+
+    def commit(self):
+        self.round_trips += 1
+        return super().commit()
+
+
+def peak_rss_mb():
+    """ Returns the peak resident set size in MB of this process and of its largest finished child process,
+        whichever is larger. On Linux ru_maxrss is in KB.
+    """
+    return max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+               resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss) / 1024
+
+
+def scale_dataset(src_dir, dst_dir, scale):
+    """ Writes a synthetic copy of the sample data that is `scale` times larger.
+        Each copy gets its own song, artist and session ids and suffixed titles and artist names,
+        and the log records of each copy refer to the songs of the same copy, so the song lookup still matches.
+
+    Args:
+    src_dir (str): The directory with song_data & log_data directories.
+    dst_dir (str): The directory to write the scaled song_data & log_data directories.
+    scale (int): The number of copies.
+    """
+    if os.path.isdir(dst_dir):
+        print('Reusing the scaled dataset in {}'.format(dst_dir))
+        return
+    for filepath in etl.get_files(os.path.join(src_dir, 'song_data')):
+        records = etl.read_json_records([filepath])
+        relpath = os.path.relpath(filepath, src_dir)
+        for k in range(scale):
+            name, ext = os.path.splitext(relpath)
+            out_path = os.path.join(dst_dir, '{}_{}{}'.format(name, k, ext))
+            os.makedirs(os.path.dirname(out_path), exist_ok=True)
+            with open(out_path, 'w') as f:
+                for record in records:
+                    record = dict(record, song_id='{}X{}'.format(record['song_id'], k),
+                                  artist_id='{}X{}'.format(record['artist_id'], k),
+                                  title='{} #{}'.format(record['title'], k),
+                                  artist_name='{} #{}'.format(record['artist_name'], k))
+                    f.write(json.dumps(record) + '\n')
+    for filepath in etl.get_files(os.path.join(src_dir, 'log_data')):
+        records = etl.read_json_records([filepath])
+        relpath = os.path.relpath(filepath, src_dir)
+        for k in range(scale):
+            name, ext = os.path.splitext(relpath)
+            out_path = os.path.join(dst_dir, '{}_{}{}'.format(name, k, ext))
+            os.makedirs(os.path.dirname(out_path), exist_ok=True)
+            with open(out_path, 'w') as f:
+                for record in records:
+                    record = dict(record, ts=record['ts'] + k, sessionId=record['sessionId'] + k * 1000000)
+                    if record['song'] is not None:
+                        record['song'] = '{} #{}'.format(record['song'], k)
+                        record['artist'] = '{} #{}'.format(record['artist'], k)
+                    f.write(json.dumps(record) + '\n')
+    print('Scaled dataset x{} is written to {}'.format(scale, dst_dir))
+
+
+def reset_database():
+    """ Recreates sparkifydb with all its tables, foreign keys and indexes. """
+    cur, conn = create_database()
+    create_tables(cur, conn)
+    create_foreign_keys(cur, conn)
+    create_indexes(cur, conn)
+    conn.close()
+
+
+def run_stage(conn, stage, func):
+    """ Runs an ETL stage and measures it.
+
+    Args:
+    conn (CountingConnection): The connection used by the stage.
+    stage (str): The name of the stage.
+    func (function): The stage, it returns the number of rows processed.
+
+    Returns:
+    result (dict): rows, wall time, rows/sec, round trips and peak RSS of the process after the stage.
+    """
+    conn.round_trips = 0
+    time_start = time.time()
+    # the per-file progress of the ETL job is not part of the benchmark output
+    with contextlib.redirect_stdout(io.StringIO()):
+        num_rows = func()
+    wall_time = time.time() - time_start
+    return {'stage': stage,
+            'rows': num_rows,
+            'wall_time': wall_time,
+            'rows_per_sec': num_rows / wall_time if wall_time > 0 else None,
+            'round_trips': conn.round_trips,
+            'peak_rss_mb': peak_rss_mb()}
+
+
+def measure_stage(stage, data_dir, mode, workers, send_end):
+    """ Runs an ETL stage on a new connection in this process and sends its measurements,
+        so the peak RSS is the one of the stage and not of the stages before it.
+
+    Args:
+    stage (str): process_song_file, process_log_file, process_data or process_data_parallel.
+    data_dir (str): The directory with song_data & log_data directories.
+    mode (str): One of the ETL configurations in `modes`.
+    workers (int): The number of worker processes of process_data_parallel.
+    send_end (multiprocessing Connection): The pipe to send the measurements to.
+    """
+    options = modes[mode]
+    conn = psycopg2.connect(etl.conn_string, connection_factory=CountingConnection)
+    cur = conn.cursor()
+    song_dir = os.path.join(data_dir, 'song_data')
+    log_dir = os.path.join(data_dir, 'log_data')
+    song_batch_size = options.get('song_batch_size')
+    song_func = etl.process_song_files if song_batch_size else etl.process_song_file
+
+    if stage == 'process_data_parallel':
+        # the workers load their own song lookup and time cache
+        log_func = functools.partial(etl.process_log_file, bulk=options.get('bulk', False))
+        funcs = [functools.partial(etl.process_data_parallel, song_dir, song_func, workers, batch_size=song_batch_size),
+                 functools.partial(etl.process_data_parallel, log_dir, log_func, workers,
+                                   load_lookup=options.get('lookup', False), load_time_dim=options.get('time_cache', False))]
+    else:
+        lookup = None
+        if options.get('lookup'):
+            lookup = etl.SongLookup()
+            lookup.load(cur)
+        time_dim = None
+        if options.get('time_cache'):
+            time_dim = etl.TimeDimension(etl.time_start_select)
+            time_dim.load(cur)
+        log_func = functools.partial(etl.process_log_file, bulk=options.get('bulk', False),
+                                     lookup=lookup, time_dim=time_dim)
+        song_stage = functools.partial(etl.process_data, cur, conn, song_dir, functools.partial(song_func, lookup=lookup),
+                                       batch_size=song_batch_size, lookup=lookup)
+        log_stage = functools.partial(etl.process_data, cur, conn, log_dir, log_func, time_dim=time_dim)
+        funcs = {'process_song_file': [song_stage], 'process_log_file': [log_stage],
+                 'process_data': [song_stage, log_stage]}[stage]
+
+    # the ETL functions return the number of rows and the files that are rolled back and skipped
+    result = run_stage(conn, stage, lambda: sum(func()[0] for func in funcs))
+    if stage == 'process_data_parallel':
+        # the workers send their statements on their own connections, which are not counted
+        result['round_trips'] = None
+    cur.close()
+    conn.close()
+    send_end.send(result)
+    send_end.close()
+
+
+def run_stage_process(stage, data_dir, mode, workers):
+    """ Runs an ETL stage in its own process, see `measure_stage`.
+
+    Returns:
+    result (dict): rows, wall time, rows/sec, round trips and peak RSS of the stage.
+    """
+    recv_end, send_end = multiprocessing.Pipe(duplex=False)
+    process = multiprocessing.Process(target=measure_stage, args=(stage, data_dir, mode, workers, send_end))
+    process.start()
+    # without the send end in this process, recv fails instead of waiting forever if the stage crashes
+    send_end.close()
+    try:
+        result = recv_end.recv()
+    except EOFError:
+        raise RuntimeError('Stage {} of {} mode failed'.format(stage, mode))
+    finally:
+        process.join()
+    return result
+
+
+def run_benchmark(data_dir, mode, workers=4):
+    """ Loads the song and log files of a dataset into a fresh database with the given ETL mode.
+        The song and log files are measured as separate stages, then the whole run is measured on a fresh database,
+        one by one with process_data and with process_data_parallel if there is more than one worker.
+
+    Args:
+    data_dir (str): The directory with song_data & log_data directories.
+    mode (str): One of the ETL configurations in `modes`.
+    workers (int): The number of worker processes of the parallel run, 1 to skip it.
+
+    Returns:
+    results (list): The measurements of process_song_file, process_log_file, process_data and process_data_parallel.
+    """
+    reset_database()
+    results = [run_stage_process('process_song_file', data_dir, mode, workers),
+               run_stage_process('process_log_file', data_dir, mode, workers)]
+    reset_database()
+    results.append(run_stage_process('process_data', data_dir, mode, workers))
+    if workers > 1:
+        reset_database()
+        results.append(run_stage_process('process_data_parallel', data_dir, mode, workers))
+    return results
+
+
+def compare_results(results, baseline_path):
+    """ Prints the wall time change of each measurement against a previous benchmark result file.
+
+    Args:
+    results (list): The measurements of this run.
+    baseline_path (str): The JSON file of a previous run.
+    """
+    with open(baseline_path) as f:
+        baseline = {(r['scale'], r['mode'], r['stage']): r for r in json.load(f)['results']}
+    for result in results:
+        previous = baseline.get((result['scale'], result['mode'], result['stage']))
+        if previous is None or not previous['wall_time']:
+            continue
+        change = (result['wall_time'] - previous['wall_time']) / previous['wall_time'] * 100
+        print('x{:<4} {:<5} {:<21} wall time {:8.2f}s -> {:8.2f}s ({:+.1f}%)'.format(
+              result['scale'], result['mode'], result['stage'], previous['wall_time'], result['wall_time'], change))
+
+
+def main(args):
+    """ Benchmarks the ETL job on the bundled sample data and on scaled copies of it.
+
+    Args:
+    args.scales (list): Dataset sizes as multiples of the sample data, 1 is the sample data itself
+    args.modes (list): ETL configurations to benchmark
+    args.work_dir (str): Directory for the scaled datasets
+    args.output (str): JSON file to save the results
+    args.baseline (str): JSON file of a previous run to compare with
+    args.workers (int): Number of worker processes of the parallel run, 1 to skip it
+    """
+    results = []
+    for scale in args.scales:
+        data_dir = 'data'
+        if scale > 1:
+            data_dir = os.path.join(args.work_dir, 'scale_{}'.format(scale))
+            scale_dataset('data', data_dir, scale)
+        for mode in args.modes:
+            print('Benchmarking x{} dataset with {} mode'.format(scale, mode))
+            for result in run_benchmark(data_dir, mode, args.workers):
+                result.update(scale=scale, mode=mode)
+                results.append(result)
+                print('  {:<21} {:>9} rows {:8.2f}s {:>10.1f} rows/sec {:>9} round trips {:8.1f} MB peak RSS'.format(
+                      result['stage'], result['rows'], result['wall_time'], result['rows_per_sec'] or 0,
+                      '-' if result['round_trips'] is None else result['round_trips'], result['peak_rss_mb']))
+
+    with open(args.output, 'w') as f:
+        json.dump({'timestamp': datetime.now().isoformat(), 'results': results}, f, indent=2)
+    print('Results are saved to {}'.format(args.output))
+
+    if args.baseline:
+        compare_results(results, args.baseline)
+
+
+if __name__ == "__main__":
+    # Parse arguments
+    parser = argparse.ArgumentParser(description="Benchmarks the Sparkify ETL against a local Postgres")
+    parser.add_argument("--scales", type=int, nargs='+', default=[1, 10, 100], help="Dataset sizes as multiples of the sample data")
+    parser.add_argument("--modes", nargs='+', default=list(modes), choices=list(modes), help="ETL configurations to benchmark")
+    parser.add_argument("--work-dir", default='benchmark_data', help="Directory for the scaled datasets")
+    parser.add_argument("--output", default='benchmark_results.json', help="JSON file to save the results")
+    parser.add_argument("--baseline", help="JSON file of a previous run to compare with")
+    parser.add_argument("--workers", type=int, default=4, help="Number of worker processes of the parallel run, 1 to skip it")
+    args = parser.parse_args()
+
+    main(args)
@@ -1,5 +1,9 @@
+import argparse
+from datetime import datetime, timezone
 import psycopg2
-from sql_queries import create_table_queries, drop_table_queries
+from sql_queries import create_table_queries, drop_table_queries, create_index_queries, songplay_foreign_key_queries, \
+                        songplay_table_create, songplay_table_partitioned_create, \
+                        songplay_partition_create, songplay_default_partition_create
 
 
 def create_database():
@@ -36,16 +40,63 @@ def drop_tables(cur, conn):
         conn.commit()
 
 
-def create_tables(cur, conn):
+def create_tables(cur, conn, partitioned=False):
     """
     Creates each table using the queries in `create_table_queries` list. 
+    If partitioned, songplays table is created as range-partitioned on start_time.
     """
     for query in create_table_queries:
+        if partitioned and query == songplay_table_create:
+            query = songplay_table_partitioned_create
         cur.execute(query)
         conn.commit()
 
 
-def main():
+def create_foreign_keys(cur, conn):
+    """
+    Adds the foreign keys of songplays table using the queries in `songplay_foreign_key_queries` list.
+    """
+    for query in songplay_foreign_key_queries:
+        cur.execute(query)
+        conn.commit()
+
+
+def create_indexes(cur, conn):
+    """
+    Creates the indexes used by song lookups and analytical queries using the queries in `create_index_queries` list.
+    """
+    for query in create_index_queries:
+        cur.execute(query)
+        conn.commit()
+
+
+def month_start_ms(year, month):
+    """
+    Returns the unix timestamp in ms of the first moment of the given month in UTC.
+    """
+    return int(datetime(year, month, 1, tzinfo=timezone.utc).timestamp() * 1000)
+
+
+def create_songplay_partitions(cur, conn, first_month, last_month):
+    """
+    Creates one songplays partition per month between given months (inclusive, 'YYYY-MM')
+    and a default partition for start_times outside of them.
+    """
+    year, month = map(int, first_month.split('-'))
+    end_year, end_month = map(int, last_month.split('-'))
+    while (year, month) <= (end_year, end_month):
+        next_year, next_month = (year + 1, 1) if month == 12 else (year, month + 1)
+        partition_name = 'songplays_{}_{:02d}'.format(year, month)
+        cur.execute(songplay_partition_create.format(partition_name,
+                                                     month_start_ms(year, month),
+                                                     month_start_ms(next_year, next_month)))
+        conn.commit()
+        year, month = next_year, next_month
+    cur.execute(songplay_default_partition_create)
+    conn.commit()
+
+
+def main(args):
     """
     - Drops (if exists) and Creates the sparkify database. 
     
@@ -56,15 +107,34 @@ def main():
     
     - Creates all tables needed. 
     
+    - Creates the monthly partitions of songplays table if requested.
+    
+    - Creates the foreign keys and indexes, unless they are deferred
+    to the end of an initial bulk load by the ETL job.
+    
     - Finally, closes the connection. 
     """
     cur, conn = create_database()
     
     drop_tables(cur, conn)
-    create_tables(cur, conn)
+    partitioned = args.partition_months is not None
+    create_tables(cur, conn, partitioned=partitioned)
+    if partitioned:
+        create_songplay_partitions(cur, conn, *args.partition_months)
+    if not args.bulk_load:
+        create_foreign_keys(cur, conn)
+        create_indexes(cur, conn)
 
     conn.close()
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    # Parse arguments
+    parser = argparse.ArgumentParser(description="Creates sparkifydb and its tables")
+    parser.add_argument("--partition-months", nargs=2, metavar=("FIRST", "LAST"),
+                        help="Range-partition songplays by month, one partition per month from FIRST to LAST as YYYY-MM")
+    parser.add_argument("--bulk-load", action="store_true",
+                        help="Create tables without foreign keys and secondary indexes, 'etl.py --bulk-load' adds them after loading")
+    args = parser.parse_args()
+
+    main(args)
@@ -1,16 +1,48 @@
+import argparse
+import functools
+import hashlib
+import io
+import math
+import multiprocessing
 import os
 import glob
+import time
 import psycopg2
+import psycopg2.extras
 import pandas as pd
 from sql_queries import *
+from song_lookup import SongLookup
+from time_dimension import TimeDimension, build_time_table
 
+try:
+    import orjson as json
+except ImportError:
+    import json
 
-def process_song_file(cur, filepath):
+# Connection string of 'sparkifydb' database
+conn_string = "host=127.0.0.1 dbname=sparkifydb user=student password=student"
+
+# Columns of the log records used for time, users & songplays tables
+log_columns = ['ts', 'userId', 'firstName', 'lastName', 'gender', 'level',
+               'song', 'artist', 'length', 'sessionId', 'location', 'userAgent']
+
+# Connection, cursor and song lookup of a worker process in the parallel mode
+worker_conn = None
+worker_cur = None
+worker_lookup = None
+worker_time_dim = None
+
+
+def process_song_file(cur, filepath, lookup=None):
     """ Parses a song file in JSON format and inserts the relevant records into songs & artists tables.
     
     Args:
     cur (psycopg2 cursor): The cursor object to interact with the database.
     filepath (str): The absolute path of the song file.
+    lookup (SongLookup): If given, the inserted song and artist are added to this in-memory song lookup.
+    
+    Returns:
+    num_rows (int): The number of song records in the file.
     """
 
     # open song file
@@ -24,35 +56,206 @@ def process_song_file(cur, filepath):
     artist_data = list(df[['artist_id', 'artist_name', 'artist_location', 'artist_latitude', 'artist_longitude']].values[0])
     cur.execute(artist_table_insert, artist_data)
 
+    if lookup is not None:
+        lookup.add_song_df(df)
+
+    return len(df)
+
+
+def read_json_records(filepaths):
+    """ Parses line-delimited JSON files into a list of records.
+    
+    Args:
+    filepaths (list): The absolute paths of the JSON files.
+    
+    Returns:
+    records (list): The parsed records as dictionaries.
+    """
+    records = []
+    for filepath in filepaths:
+        with open(filepath, 'rb') as f:
+            for line in f:
+                if line.strip():
+                    records.append(json.loads(line))
+    return records
+
+
+def process_song_files(cur, filepaths, lookup=None):
+    """ Parses a batch of song files in JSON format into one DataFrame and inserts the relevant records
+        into songs & artists tables with a single multi-row statement per table.
+    
+    Args:
+    cur (psycopg2 cursor): The cursor object to interact with the database.
+    filepaths (list): The absolute paths of the song files.
+    lookup (SongLookup): If given, the inserted songs and artists are added to this in-memory song lookup.
+    
+    Returns:
+    num_rows (int): The number of song records in the files.
+    """
+    df = pd.DataFrame.from_records(read_json_records(filepaths))
+    if df.empty:
+        return 0
+
+    # dedupe inside the batch, a multi-row ON CONFLICT insert must not contain the same key twice
+    song_df = df[['song_id', 'title', 'artist_id', 'year', 'duration']].drop_duplicates(subset='song_id')
+    artist_df = df[['artist_id', 'artist_name', 'artist_location', 'artist_latitude', 'artist_longitude']] \
+                  .drop_duplicates(subset='artist_id')
+
+    for query, batch_df in [(song_table_batch_insert, song_df), (artist_table_batch_insert, artist_df)]:
+        batch_df = batch_df.astype(object).where(batch_df.notnull(), None)
+        psycopg2.extras.execute_values(cur, query, batch_df.values.tolist(), page_size=len(batch_df))
+
+    if lookup is not None:
+        lookup.add_song_df(df)
+
+    return len(df)
+
+
+def copy_df_to_table(cur, df, table):
+    """ Streams the rows of a DataFrame into a table using COPY FROM STDIN in CSV format.
+    
+    Args:
+    cur (psycopg2 cursor): The cursor object to interact with the database.
+    df (pandas DataFrame): The rows to copy, column names must match the columns of the table.
+    table (str): The name of the table to copy into.
+    """
+    buffer = io.StringIO()
+    df.to_csv(buffer, index=False, header=False)
+    buffer.seek(0)
+    cur.copy_expert("COPY {} ({}) FROM STDIN WITH CSV".format(table, ','.join(df.columns)), buffer)
+
+
+def bulk_load_log_data(cur, time_df, user_df, songplay_df):
+    """ Copies a batch of time, user and songplay rows into temporary tables and merges them
+        into time, users & songplays tables with set-based inserts.
+    
+    Args:
+    cur (psycopg2 cursor): The cursor object to interact with the database.
+    time_df (pandas DataFrame): The rows for time table.
+    user_df (pandas DataFrame): The rows for users table, in the order they appear in the log.
+    songplay_df (pandas DataFrame): The songplay rows, either with resolved song_id & artist_id
+                                    or with song title, artist name and length for the song lookup.
+    """
+    for query in tmp_table_create_queries:
+        cur.execute(query)
+    cur.execute(tmp_tables_truncate)
+
+    # a single INSERT ... ON CONFLICT DO UPDATE cannot touch the same user twice,
+    # keeping the last row of each user matches the outcome of the row-at-a-time upserts.
+    user_df = user_df.drop_duplicates(subset='user_id', keep='last')
+    time_df = time_df.drop_duplicates(subset='start_time')
+
+    copy_df_to_table(cur, time_df, 'time_tmp')
+    copy_df_to_table(cur, user_df, 'users_tmp')
+    cur.execute(time_table_bulk_insert)
+    cur.execute(user_table_bulk_insert)
+
+    if 'song_id' in songplay_df.columns:
+        # ids are already resolved, songplays have no conflicts to handle
+        copy_df_to_table(cur, songplay_df, 'songplays')
+    else:
+        copy_df_to_table(cur, songplay_df, 'songplays_tmp')
+        cur.execute(songplay_table_bulk_insert)
+    cur.execute(tmp_tables_truncate)
+
+
+def read_log_chunks(filepath, chunk_size):
+    """ Streams a log file in JSON format and yields its NextSong records in fixed-size chunks.
+        Only the columns needed for time, users & songplays tables are kept, so the memory usage
+        depends on the chunk size and not on the size of the file.
+    
+    Args:
+    filepath (str): The absolute path of the log file.
+    chunk_size (int): The maximum number of records in a chunk.
+    
+    Yields:
+    df (pandas DataFrame): A chunk of NextSong records.
+    """
+    records = []
+    with open(filepath, 'rb') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if record.get('page') != 'NextSong':
+                continue
+            records.append([record.get(column) for column in log_columns])
+            if len(records) == chunk_size:
+                yield pd.DataFrame.from_records(records, columns=log_columns)
+                records = []
+    if records:
+        yield pd.DataFrame.from_records(records, columns=log_columns)
 
-def process_log_file(cur, filepath):
+
+def process_log_file(cur, filepath, bulk=False, lookup=None, chunk_size=None, time_dim=None):
     """ Parses a log file in JSON format and inserts the relevant records into time, users & songplays tables.
     
     Args:
     cur (psycopg2 cursor): The cursor object to interact with the database.
     filepath (str): The absolute path of the log file.
+    bulk (bool): If True, the records are loaded with COPY and set-based merges instead of one insert per row.
+    lookup (SongLookup): If given, song and artist ids are resolved in memory instead of querying the database per row.
+    chunk_size (int): If given, the file is streamed and loaded in chunks of this many records instead of reading it at once.
+    time_dim (TimeDimension): If given, only the start_times missing from this time cache are inserted into time table.
+    
+    Returns:
+    num_rows (int): The number of songplay records in the file.
     """
+    if chunk_size:
+        num_rows = 0
+        for df in read_log_chunks(filepath, chunk_size):
+            num_rows += process_log_df(cur, df, bulk=bulk, lookup=lookup, time_dim=time_dim)
+        return num_rows
+
     # open log file
     df = pd.read_json(filepath, lines=True)
 
     # filter by NextSong action
     df = df.loc[df['page'] == 'NextSong']
 
-    # convert timestamp column to datetime
-    t = pd.to_datetime(df['ts'], unit='ms')
-    
-    # insert time data records
-    time_data = (df['ts'].values, t.dt.hour.values, t.dt.day.values,
-                 t.dt.week.values, t.dt.month.values, t.dt.year.values, t.dt.weekday.values)
-    column_labels = ('ts','hour','day','week','month','year','weekday')
-    time_df = pd.DataFrame.from_dict(dict(zip(column_labels, time_data)))
+    return process_log_df(cur, df, bulk=bulk, lookup=lookup, time_dim=time_dim)
 
-    for i, row in time_df.iterrows():
-        cur.execute(time_table_insert, list(row))
+
+def process_log_df(cur, df, bulk=False, lookup=None, time_dim=None):
+    """ Inserts the NextSong records of a log file into time, users & songplays tables.
+    
+    Args:
+    cur (psycopg2 cursor): The cursor object to interact with the database.
+    df (pandas DataFrame): NextSong records of a log file.
+    bulk (bool): If True, the records are loaded with COPY and set-based merges instead of one insert per row.
+    lookup (SongLookup): If given, song and artist ids are resolved in memory instead of querying the database per row.
+    time_dim (TimeDimension): If given, only the start_times missing from this time cache are inserted into time table.
+    
+    Returns:
+    num_rows (int): The number of songplay records.
+    """
+    # build time data records, skipping the start_times already loaded if the time cache is used
+    if time_dim is not None:
+        time_df = time_dim.new_rows(df['ts'])
+    else:
+        time_df = build_time_table(df['ts'])
 
     # load user table
     user_df = df[['userId','firstName','lastName','gender','level']]
 
+    # get songid and artistid of all songplays at once from the in-memory song lookup
+    if lookup is not None:
+        df = lookup.resolve(df)
+
+    if bulk:
+        if lookup is not None:
+            songplay_df = df[['ts','userId','level','song_id','artist_id','sessionId','location','userAgent']]
+            songplay_df.columns = ['start_time','user_id','level','song_id','artist_id','session_id','location','user_agent']
+        else:
+            songplay_df = df[['ts','userId','level','song','artist','length','sessionId','location','userAgent']]
+            songplay_df.columns = ['start_time','user_id','level','song','artist','length','session_id','location','user_agent']
+        user_df.columns = ['user_id','first_name','last_name','gender','level']
+        bulk_load_log_data(cur, time_df, user_df, songplay_df)
+        return len(df)
+
+    for i, row in time_df.iterrows():
+        cur.execute(time_table_insert, list(row))
+
     # insert user records
     for i, row in user_df.iterrows():
         cur.execute(user_table_insert, row)
@@ -60,60 +263,517 @@ def process_log_file(cur, filepath):
     # insert songplay records
     for index, row in df.iterrows():
         
-        # get songid and artistid from song and artist tables
-        cur.execute(song_select, (row.song, row.artist, row.length))
-        results = cur.fetchone()
-        
-        if results:
-            songid, artistid = results
+        if lookup is not None:
+            songid, artistid = row.song_id, row.artist_id
         else:
-            songid, artistid = None, None
+            # get songid and artistid from song and artist tables
+            cur.execute(song_select, (row.song, row.artist, row.length))
+            results = cur.fetchone()
+
+            if results:
+                songid, artistid = results
+            else:
+                songid, artistid = None, None
 
         # insert songplay record
         # songplay_id of songplays table is a 'bigserial primary key', so it is automatically handled during inserts below.
         songplay_data = (row.ts, row.userId, row.level, songid, artistid, row.sessionId, row.location, row.userAgent)
         cur.execute(songplay_table_insert, songplay_data)
 
+    return len(df)
 
-def process_data(cur, conn, filepath, func):
-    """ Finds all JSON files in a given path and applies given function to each file one by one.
+
+class ProgressReporter:
+    """ Aggregates the number of processed files and rows and reports the throughput. """
+
+    def __init__(self, num_files):
+        self.num_files = num_files
+        self.files_done = 0
+        self.rows_done = 0
+        self.time_start = time.time()
+
+    def update(self, num_files, num_rows):
+        """ Adds processed files and rows, then prints the progress.
+        
+        Args:
+        num_files (int): The number of files processed since the last update.
+        num_rows (int): The number of rows processed since the last update.
+        """
+        self.files_done += num_files
+        self.rows_done += num_rows
+        time_pass = max(time.time() - self.time_start, 1e-9)
+        print('{}/{} files processed, {:.1f} files/sec, {:.1f} rows/sec'.format(
+              self.files_done, self.num_files, self.files_done / time_pass, self.rows_done / time_pass))
+
+
+def get_files(filepath):
+    """ Finds all JSON files in a given path.
     
     Args:
-    cur (psycopg2 cursor): The cursor object to interact with the database.
-    conn (psycopg2 connection): The connection object to the database.
     filepath (str): The absolute path of the directory to search for files.
-    func (function): A function which applied to each JSON file under given directory.
+    
+    Returns:
+    all_files (list): The absolute paths of the JSON files.
     """
-    # get all files matching extension from directory
     all_files = []
     for root, dirs, files in os.walk(filepath):
         files = glob.glob(os.path.join(root,'*.json'))
         for f in files :
             all_files.append(os.path.abspath(f))
+    return all_files
+
+
+def file_state(filepath):
+    """ Reads the size, modification time and content hash of a file.
+    
+    Args:
+    filepath (str): The absolute path of the file.
+    
+    Returns:
+    state (tuple): size in bytes, modification time and SHA-256 hash of the content.
+    """
+    stat = os.stat(filepath)
+    content_hash = hashlib.sha256()
+    with open(filepath, 'rb') as f:
+        for block in iter(functools.partial(f.read, 1 << 20), b''):
+            content_hash.update(block)
+    return stat.st_size, stat.st_mtime, content_hash.hexdigest()
+
+
+def get_new_files(cur, conn, all_files, reload_changed=True):
+    """ Filters out the files that are already recorded in the ingestion manifest and unchanged since.
+        A file whose size and modification time match its manifest entry is skipped without reading it,
+        the content hash is only checked when the modification time changed but the size did not.
+    
+    Args:
+    cur (psycopg2 cursor): The cursor object to interact with the database.
+    conn (psycopg2 connection): The connection object to the database.
+    all_files (list): The absolute paths of the files.
+    reload_changed (bool): If False, a changed file is an error instead of being loaded again,
+                           for log files whose songplays from the earlier load would be inserted twice.
+    
+    Returns:
+    new_files (list): The absolute paths of the new or changed files.
+    
+    Raises:
+    ValueError: If reload_changed is False and files recorded in the manifest have changed.
+    """
+    cur.execute(manifest_table_create)
+    cur.execute(manifest_select)
+    manifest = {path: (size, mtime, content_hash) for path, size, mtime, content_hash in cur.fetchall()}
+
+    new_files = []
+    changed_files = []
+    for filepath in all_files:
+        entry = manifest.get(filepath)
+        if entry is not None:
+            stat = os.stat(filepath)
+            if (stat.st_size, stat.st_mtime) == entry[:2]:
+                continue
+            if stat.st_size == entry[0]:
+                state = file_state(filepath)
+                if state[2] == entry[2]:
+                    # only touched, remember the new modification time to skip hashing next time
+                    cur.execute(manifest_upsert, (filepath,) + state)
+                    continue
+            changed_files.append(filepath)
+        new_files.append(filepath)
+    conn.commit()
+    if changed_files and not reload_changed:
+        raise ValueError('{} files changed since they were loaded, songplays have no key to replace their earlier rows. '
+                         'Restore the files or recreate the database to load them again:\n{}'.format(
+                         len(changed_files), '\n'.join(changed_files)))
+    return new_files
+
+
+def check_manifest(cur, conn):
+    """ Checks that the ingestion manifest knows the loaded files before an incremental run.
+    
+    Args:
+    cur (psycopg2 cursor): The cursor object to interact with the database.
+    conn (psycopg2 connection): The connection object to the database.
+    
+    Raises:
+    ValueError: If songplays are loaded but no file is recorded in the manifest.
+    """
+    cur.execute(manifest_select)
+    manifest_empty = cur.fetchone() is None
+    cur.execute(songplay_exists_select)
+    songplays_loaded = cur.fetchone()[0]
+    conn.commit()
+    if manifest_empty and songplays_loaded:
+        raise ValueError('songplays are loaded but the ingestion manifest is empty, every log file would be loaded again. '
+                         'Recreate the database to load the files in incremental mode.')
+
+
+def record_files(cur, files):
+    """ Records processed files in the ingestion manifest, in the same transaction as their data.
+        The files of every run are recorded, so that a later incremental run knows what is loaded.
+    
+    Args:
+    cur (psycopg2 cursor): The cursor object to interact with the database.
+    files (list): The absolute paths of the processed files.
+    """
+    for filepath in files:
+        cur.execute(manifest_upsert, (filepath,) + file_state(filepath))
+
+
+class CommitPolicy:
+    """ Decides when the transaction of a connection is committed: after every file by default,
+        or every N rows and/or T seconds so that the commit overhead is shared by many files.
+    
+    When several files share a transaction, each file runs in its own savepoint,
+    so a bad file is rolled back alone and skipped while the other files are kept.
+    A file whose transaction is rolled back by a deadlock is retried.
+    """
+
+    def __init__(self, conn, every_rows=None, every_seconds=None, time_dim=None, max_retries=3, lookup=None):
+        self.conn = conn
+        self.every_rows = every_rows
+        self.every_seconds = every_seconds
+        self.time_dim = time_dim
+        self.lookup = lookup
+        self.max_retries = max_retries
+        self.uncommitted_rows = 0
+        self.last_commit = time.time()
+        self.failed_files = []
+
+    @property
+    def batched(self):
+        return bool(self.every_rows or self.every_seconds)
+
+    def apply(self, cur, func, datafile, files):
+        """ Applies given function to a file or a batch of files and commits if it is due.
+        
+        Args:
+        cur (psycopg2 cursor): The cursor object to interact with the database.
+        func (function): A function which applied to the file.
+        datafile (str or list): The argument of the function, a file or a batch of files.
+        files (list): The absolute paths of the files processed by this call, recorded in the ingestion manifest.
+        
+        Returns:
+        num_rows (int): The number of rows processed, 0 if the files are skipped.
+        """
+        for attempt in range(1, self.max_retries + 1):
+            if self.batched:
+                cur.execute(file_savepoint)
+            try:
+                num_rows = func(cur, datafile)
+                record_files(cur, files)
+            except Exception as e:
+                self.rollback(cur)
+                if isinstance(e, psycopg2.extensions.TransactionRollbackError) and attempt < self.max_retries:
+                    continue
+                if not self.batched:
+                    raise
+                self.failed_files.extend(files)
+                print('{} rolled back and skipped: {}'.format(', '.join(files), e))
+                return 0
+            break
+
+        # the songs of the file are kept in the song lookup, they are added to its index at the commit
+        if self.lookup is not None:
+            self.lookup.release()
+        if not self.batched:
+            self.commit()
+            return num_rows
+
+        cur.execute(file_savepoint_release)
+        self.uncommitted_rows += num_rows
+        if (self.every_rows and self.uncommitted_rows >= self.every_rows) or \
+           (self.every_seconds and time.time() - self.last_commit >= self.every_seconds):
+            self.commit()
+        return num_rows
+
+    def rollback(self, cur):
+        """ Rolls back the current file, to its savepoint if files share the transaction. """
+        if self.batched:
+            cur.execute(file_savepoint_rollback)
+        else:
+            self.conn.rollback()
+        # pending start_times of the earlier files of the transaction are forgotten too,
+        # they are only sent again and ignored by ON CONFLICT DO NOTHING.
+        if self.time_dim is not None:
+            self.time_dim.rollback()
+        if self.lookup is not None:
+            self.lookup.rollback()
+
+    def commit(self):
+        """ Commits the transaction. """
+        self.conn.commit()
+        if self.time_dim is not None:
+            self.time_dim.commit()
+        if self.lookup is not None:
+            self.lookup.commit()
+        self.uncommitted_rows = 0
+        self.last_commit = time.time()
+
+
+def process_data(cur, conn, filepath, func, batch_size=None, incremental=False, time_dim=None,
+                 commit_rows=None, commit_seconds=None, lookup=None, reload_changed=True):
+    """ Finds all JSON files in a given path and applies given function to each file one by one.
+    
+    Args:
+    cur (psycopg2 cursor): The cursor object to interact with the database.
+    conn (psycopg2 connection): The connection object to the database.
+    filepath (str): The absolute path of the directory to search for files.
+    func (function): A function which applied to each JSON file under given directory.
+    batch_size (int): If given, the function is applied to batches of this many files instead of a single file.
+    incremental (bool): If True, only the files that are new or changed since they were recorded in the ingestion manifest are processed.
+    time_dim (TimeDimension): The time cache used by the function, it is told when the transaction is committed.
+    commit_rows (int): If given, commits every this many rows instead of after every file.
+    commit_seconds (float): If given, commits every this many seconds instead of after every file.
+    lookup (SongLookup): The song lookup used by the function, it is told when the transaction is committed.
+    reload_changed (bool): If False, files changed since they were recorded in the ingestion manifest are an error.
+    
+    Returns:
+    num_rows (int): The number of rows processed.
+    failed_files (list): The absolute paths of the files that are rolled back and skipped.
+    """
+    # get all files matching extension from directory
+    all_files = get_files(filepath)
 
     # get total number of files found
     num_files = len(all_files)
     print('{} files found in {}'.format(num_files, filepath))
 
+    # skip the files processed in previous runs
+    if incremental:
+        all_files = get_new_files(cur, conn, all_files, reload_changed)
+        print('{} of them are new or changed since the last run'.format(len(all_files)))
+        num_files = len(all_files)
+
     # iterate over files and process
-    for i, datafile in enumerate(all_files, 1):
-        func(cur, datafile)
+    progress = ProgressReporter(num_files)
+    policy = CommitPolicy(conn, commit_rows, commit_seconds, time_dim, lookup=lookup)
+    if batch_size:
+        for i in range(0, num_files, batch_size):
+            batch = all_files[i:i + batch_size]
+            num_rows = policy.apply(cur, func, batch, batch)
+            progress.update(len(batch), num_rows)
+    else:
+        for datafile in all_files:
+            num_rows = policy.apply(cur, func, datafile, [datafile])
+            progress.update(1, num_rows)
+    policy.commit()
+
+    if policy.failed_files:
+        print('{} files are rolled back and skipped'.format(len(policy.failed_files)))
+    return progress.rows_done, policy.failed_files
+
+
+def init_worker(conn_string, load_lookup, load_time_dim=False):
+    """ Opens the database connection of a worker process and optionally loads its song lookup and time cache.
+    
+    Args:
+    conn_string (str): The connection string of the database.
+    load_lookup (bool): If True, the song lookup is loaded from songs & artists tables.
+    load_time_dim (bool): If True, the time cache is loaded from time table.
+    """
+    global worker_conn, worker_cur, worker_lookup, worker_time_dim
+    worker_conn = psycopg2.connect(conn_string)
+    worker_cur = worker_conn.cursor()
+    if load_lookup:
+        worker_lookup = SongLookup()
+        worker_lookup.load(worker_cur)
+    if load_time_dim:
+        worker_time_dim = TimeDimension(time_start_select)
+        worker_time_dim.load(worker_cur)
+        worker_conn.commit()
+
+
+def process_files_worker(func, files, batch=False, commit_rows=None, commit_seconds=None):
+    """ Applies given function to a share of files on the connection of the worker process.
+        The share is always committed at the end, so the commit policy only batches commits within a share.
+    
+    Args:
+    func (function): A function which applied to each JSON file.
+    files (list): The absolute paths of the files.
+    batch (bool): If True, the function is applied once to the whole share of files.
+    commit_rows (int): If given, commits every this many rows instead of after every file.
+    commit_seconds (float): If given, commits every this many seconds instead of after every file.
+    
+    Returns:
+    num_files (int): The number of processed files.
+    num_rows (int): The number of processed rows.
+    failed_files (list): The absolute paths of the files that are rolled back and skipped.
+    """
+    kwargs = {}
+    if worker_lookup is not None:
+        kwargs['lookup'] = worker_lookup
+    if worker_time_dim is not None:
+        kwargs['time_dim'] = worker_time_dim
+    func = functools.partial(func, **kwargs)
+
+    policy = CommitPolicy(worker_conn, commit_rows, commit_seconds, worker_time_dim, lookup=worker_lookup)
+    num_rows = 0
+    if batch:
+        num_rows += policy.apply(worker_cur, func, files, files)
+    else:
+        for datafile in files:
+            num_rows += policy.apply(worker_cur, func, datafile, [datafile])
+    policy.commit()
+    return len(files), num_rows, policy.failed_files
+
+
+def process_data_parallel(filepath, func, workers, load_lookup=False, batch_size=None, incremental=False, load_time_dim=False,
+                          conn=None, dsn=conn_string, commit_rows=None, commit_seconds=None, reload_changed=True):
+    """ Finds all JSON files in a given path and applies given function to the files
+        in a pool of worker processes, each with its own database connection and share of files.
+    
+    Args:
+    filepath (str): The absolute path of the directory to search for files.
+    func (function): A function which applied to each JSON file under given directory.
+    workers (int): The number of worker processes.
+    load_lookup (bool): If True, each worker loads the song lookup before processing its files.
+    batch_size (int): If given, the function is applied to batches of this many files instead of a single file.
+    incremental (bool): If True, only the files that are new or changed since they were recorded in the ingestion manifest are processed.
+    load_time_dim (bool): If True, each worker loads the time cache before processing its files.
+    conn (psycopg2 connection): The connection used to read the ingestion manifest, required if incremental.
+    dsn (str): The connection string of the database for the worker processes.
+    commit_rows (int): If given, workers commit every this many rows instead of after every file.
+    commit_seconds (float): If given, workers commit every this many seconds instead of after every file.
+    reload_changed (bool): If False, files changed since they were recorded in the ingestion manifest are an error.
+    
+    Returns:
+    num_rows (int): The number of rows processed.
+    failed_files (list): The absolute paths of the files that are rolled back and skipped by the workers.
+    """
+    all_files = get_files(filepath)
+    num_files = len(all_files)
+    print('{} files found in {}, processing with {} workers'.format(num_files, filepath, workers))
+
+    # skip the files processed in previous runs
+    if incremental:
+        all_files = get_new_files(conn.cursor(), conn, all_files, reload_changed)
+        print('{} of them are new or changed since the last run'.format(len(all_files)))
+        num_files = len(all_files)
+
+    # small shares keep the workers balanced and the progress reports frequent
+    share_size = batch_size or max(1, min(100, math.ceil(num_files / (4 * workers))))
+    shares = [all_files[i:i + share_size] for i in range(0, num_files, share_size)]
+
+    progress = ProgressReporter(num_files)
+    failed_files = []
+    with multiprocessing.Pool(workers, initializer=init_worker, initargs=(dsn, load_lookup, load_time_dim)) as pool:
+        worker_func = functools.partial(process_files_worker, func, batch=bool(batch_size), commit_rows=commit_rows, commit_seconds=commit_seconds)
+        for num_files_done, num_rows, share_failed_files in pool.imap_unordered(worker_func, shares):
+            progress.update(num_files_done, num_rows)
+            failed_files.extend(share_failed_files)
+
+    if failed_files:
+        print('{} files are rolled back and skipped'.format(len(failed_files)))
+    return progress.rows_done, failed_files
+
+
+def finalize_bulk_load(cur, conn):
+    """ Adds the foreign keys and indexes deferred by 'create_tables.py --bulk-load' and updates the table statistics.
+        Constraints are validated and indexes are built once over all rows instead of row by row during the load.
+    
+    Args:
+    cur (psycopg2 cursor): The cursor object to interact with the database.
+    conn (psycopg2 connection): The connection object to the database.
+    """
+    print('Adding foreign keys and indexes, then analyzing the tables')
+    for query in songplay_foreign_key_queries + create_index_queries + [tables_analyze]:
+        cur.execute(query)
         conn.commit()
-        print('{}/{} files processed.'.format(i, num_files))
 
 
-def main():
-    """ Connects to PostgreSQL database and process song files and log files."""
-    # Connect to 'sparkifydb' database
-    conn = psycopg2.connect("host=127.0.0.1 dbname=sparkifydb user=student password=student")
+def main(args):
+    """ Connects to PostgreSQL database and process song files and log files.
+    
+    Args:
+    args.bulk (boolean): Loads log files with COPY and set-based merges instead of one insert per row
+    args.lookup (boolean): Resolves songplays with an in-memory song lookup instead of one query per row
+    args.workers (int): The number of worker processes, files are processed one by one if it is 1
+    args.song_batch_size (int): The number of song files parsed and inserted together, 0 for one file at a time
+    args.incremental (boolean): Processes only the files that are new or changed since the last run
+    args.chunk_size (int): The number of log records loaded at a time when streaming log files, 0 to read each file at once
+    args.time_cache (boolean): Dedupes start_times client-side against the ones already in time table
+    args.bulk_load (boolean): Adds the foreign keys and indexes deferred by 'create_tables.py --bulk-load' after loading
+    args.dsn (str): The connection string of the database
+    args.commit_rows (int): Commits every this many rows, 0 to commit after every file
+    args.commit_seconds (float): Commits every this many seconds, 0 to commit after every file
+    args.data_dir (str): The directory with song_data & log_data directories
+    
+    Raises:
+    SystemExit: If files are rolled back and skipped, after the other files are loaded.
+    """
+    log_func = functools.partial(process_log_file, bulk=args.bulk, chunk_size=args.chunk_size or None)
+
+    song_func = process_song_files if args.song_batch_size else process_song_file
+    song_batch_size = args.song_batch_size or None
+    commit_policy = {'commit_rows': args.commit_rows or None, 'commit_seconds': args.commit_seconds or None}
+    song_dir = os.path.join(args.data_dir, 'song_data')
+    log_dir = os.path.join(args.data_dir, 'log_data')
+
+    # Connect to 'sparkifydb' database, the worker processes open their own connections
+    conn = psycopg2.connect(args.dsn)
     cur = conn.cursor()
-    # Process song files and log files
-    process_data(cur, conn, filepath='data/song_data', func=process_song_file)
-    process_data(cur, conn, filepath='data/log_data', func=process_log_file)
+    # The loaded files are recorded in every run, also in databases created before the manifest table
+    cur.execute(manifest_table_create)
+    conn.commit()
+    if args.incremental:
+        check_manifest(cur, conn)
+
+    if args.workers > 1:
+        # Song files must be finished before the log files are resolved against songs & artists
+        song_rows, song_failed_files = process_data_parallel(filepath=song_dir, func=song_func, workers=args.workers,
+                                                             batch_size=song_batch_size, incremental=args.incremental,
+                                                             conn=conn, dsn=args.dsn, **commit_policy)
+        log_rows, log_failed_files = process_data_parallel(filepath=log_dir, func=log_func,
+                                                           workers=args.workers, load_lookup=args.lookup, incremental=args.incremental,
+                                                           load_time_dim=args.time_cache, conn=conn, dsn=args.dsn, reload_changed=False,
+                                                           **commit_policy)
+    else:
+        # Build the song lookup from songs and artists loaded in previous runs
+        lookup = None
+        if args.lookup:
+            lookup = SongLookup()
+            lookup.load(cur)
+        # Build the time cache from start_times loaded in previous runs
+        time_dim = None
+        if args.time_cache:
+            time_dim = TimeDimension(time_start_select)
+            time_dim.load(cur)
+        # Process song files and log files
+        song_rows, song_failed_files = process_data(cur, conn, filepath=song_dir, func=functools.partial(song_func, lookup=lookup),
+                                                    batch_size=song_batch_size, incremental=args.incremental, lookup=lookup,
+                                                    **commit_policy)
+        log_rows, log_failed_files = process_data(cur, conn, filepath=log_dir,
+                                                  func=functools.partial(log_func, lookup=lookup, time_dim=time_dim),
+                                                  incremental=args.incremental, time_dim=time_dim, reload_changed=False,
+                                                  **commit_policy)
+
+    # Files rolled back by the commit policy are skipped, the run fails after the other files are loaded
+    failed_files = song_failed_files + log_failed_files
+
+    if args.bulk_load:
+        finalize_bulk_load(cur, conn)
     # Close the cursor and connection to the database
     cur.close()
     conn.close()
 
+    if failed_files:
+        raise SystemExit('{} files are rolled back and skipped:\n{}'.format(len(failed_files), '\n'.join(failed_files)))
+
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    # Parse arguments
+    parser = argparse.ArgumentParser(description="Sparkify ETL")
+    parser.add_argument("--bulk", help="Load log files with COPY FROM STDIN and set-based merges", action="store_true")
+    parser.add_argument("--lookup", help="Resolve songplays with an in-memory song lookup instead of song_select queries", action="store_true")
+    parser.add_argument("--workers", type=int, default=1, help="Number of worker processes, each with its own connection")
+    parser.add_argument("--song-batch-size", type=int, default=0, help="Number of song files parsed and inserted together")
+    parser.add_argument("--chunk-size", type=int, default=0, help="Stream log files and load them in chunks of this many records")
+    parser.add_argument("--time-cache", help="Insert only start_times missing from a client-side cache of time table", action="store_true")
+    parser.add_argument("--bulk-load", help="Add the foreign keys and indexes deferred by 'create_tables.py --bulk-load' after loading", action="store_true")
+    parser.add_argument("--incremental", help="Process only new or changed files recorded in the ingestion manifest", action="store_true")
+    parser.add_argument("--dsn", default=conn_string, help="Connection string of the database")
+    parser.add_argument("--commit-rows", type=int, default=0, help="Commit every this many rows, each file in its own savepoint")
+    parser.add_argument("--commit-seconds", type=float, default=0, help="Commit every this many seconds, each file in its own savepoint")
+    parser.add_argument("--data-dir", default='data', help="Directory with song_data & log_data directories")
+    args = parser.parse_args()
+
+    main(args)
\ No newline at end of file
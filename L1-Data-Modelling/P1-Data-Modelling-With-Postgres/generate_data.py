@@ -0,0 +1,359 @@
+import argparse
+import collections
+import csv
+import functools
+import heapq
+import json
+import math
+import multiprocessing
+import os
+import random
+import string
+from datetime import datetime, timedelta, timezone
+from etl import get_files, read_json_records
+
+# Characters of the generated track, song and artist ids
+id_chars = string.ascii_uppercase + string.digits
+
+# Number of songs written by a single task of the worker pool
+songs_per_task = 10000
+
+# Day length in ms
+day_ms = 24 * 60 * 60 * 1000
+
+# Columns of the event_data csv files of the Cassandra project, the event logs without userAgent
+event_csv_columns = ['artist', 'auth', 'firstName', 'gender', 'itemInSession', 'lastName', 'length', 'level', 'location',
+                     'method', 'page', 'registration', 'sessionId', 'song', 'status', 'ts', 'userId']
+
+
+def fit_zipf_exponent(counts):
+    """ Fits the exponent s of a Zipf law count ~ rank^-s by least squares on the log-log scale.
+
+    Args:
+    counts (list): Play counts of the songs.
+
+    Returns:
+    s (float): The exponent, clipped to a sensible range for small samples.
+    """
+    counts = sorted(counts, reverse=True)
+    if len(counts) < 2:
+        return 1.0
+    xs = [math.log(rank) for rank in range(1, len(counts) + 1)]
+    ys = [math.log(count) for count in counts]
+    x_mean, y_mean = sum(xs) / len(xs), sum(ys) / len(ys)
+    slope = sum((x - x_mean) * (y - y_mean) for x, y in zip(xs, ys)) / sum((x - x_mean) ** 2 for x in xs)
+    return min(max(-slope, 0.1), 2.0)
+
+
+def learn_profile(data_dir):
+    """ Learns the schemas and value distributions of the song files and the event logs of a dataset.
+
+    Args:
+    data_dir (str): The directory with song_data & log_data directories.
+
+    Returns:
+    profile (dict): Value pools and empirical distributions used by the generator.
+    """
+    songs = read_json_records(get_files(os.path.join(data_dir, 'song_data')))
+    events = read_json_records(get_files(os.path.join(data_dir, 'log_data')))
+
+    # songs and artists
+    artists = {song['artist_id']: song for song in songs}
+    title_words = [word for song in songs for word in song['title'].split()]
+    artist_words = [word for artist in artists.values() for word in artist['artist_name'].split()]
+    artist_places = [(a['artist_location'], a['artist_latitude'], a['artist_longitude']) for a in artists.values()]
+
+    # users, a user keeps the same name, gender, location and user agent in all events
+    users = {}
+    for event in events:
+        if event['userId']:
+            users[event['userId']] = (event['firstName'], event['lastName'], event['gender'],
+                                      event['location'], event['userAgent'], event['registration'])
+    levels = collections.Counter(event['level'] for event in events)
+
+    # pages with their method, status and the share of logged out events
+    pages = collections.Counter(event['page'] for event in events)
+    page_attrs = {}
+    for page in pages:
+        page_events = [event for event in events if event['page'] == page]
+        method, status = collections.Counter((e['method'], e['status']) for e in page_events).most_common(1)[0][0]
+        logged_out = sum(1 for e in page_events if e['auth'] == 'Logged Out') / len(page_events)
+        page_attrs[page] = (method, status, logged_out)
+
+    # sessions, their lengths and the time between their events
+    sessions = collections.defaultdict(list)
+    for event in events:
+        sessions[event['sessionId']].append(event['ts'])
+    session_lengths = [len(ts) for ts in sessions.values()]
+    gaps = [b - a for ts in sessions.values() for a, b in zip(sorted(ts), sorted(ts)[1:]) if 0 < b - a < 3600 * 1000]
+    num_days = max(1, len(set(datetime.fromtimestamp(e['ts'] / 1000, timezone.utc).date() for e in events)))
+
+    # song popularity skew
+    plays = collections.Counter((e['song'], e['artist']) for e in events if e['page'] == 'NextSong')
+
+    return {'title_words': title_words,
+            'artist_words': artist_words,
+            'artist_places': artist_places,
+            'durations': [song['duration'] for song in songs],
+            'years': [song['year'] for song in songs],
+            'songs_per_artist': len(songs) / max(1, len(artists)),
+            'first_names': [(user[0], user[2]) for user in users.values()],
+            'last_names': [user[1] for user in users.values()],
+            'locations': [user[3] for user in users.values()],
+            'user_agents': [user[4] for user in users.values()],
+            'paid_ratio': levels['paid'] / max(1, sum(levels.values())),
+            'pages': list(pages),
+            'page_weights': [pages[page] for page in pages],
+            'page_attrs': page_attrs,
+            'session_lengths': session_lengths,
+            'gaps': gaps or [60 * 1000],
+            'sessions_per_day': len(sessions) / num_days,
+            'num_users': len(users),
+            'zipf_s': fit_zipf_exponent(list(plays.values()))}
+
+
+def random_id(rng, prefix, length=16):
+    """ Returns an id like the ones in the dataset, e.g. 'SO' followed by 16 upper case letters and digits. """
+    return prefix + ''.join(rng.choice(id_chars) for _ in range(length))
+
+
+def make_artist(profile, seed, index):
+    """ Generates the artist with the given index, the same seed and index always give the same artist. """
+    rng = random.Random('artist-{}-{}'.format(seed, index))
+    location, latitude, longitude = rng.choice(profile['artist_places'])
+    return {'artist_id': random_id(rng, 'AR'),
+            'artist_name': ' '.join(rng.choice(profile['artist_words']) for _ in range(rng.randint(1, 3))),
+            'artist_location': location,
+            'artist_latitude': latitude,
+            'artist_longitude': longitude}
+
+
+def make_song(profile, seed, index, num_artists):
+    """ Generates the song record with the given index, the same seed and index always give the same song. """
+    rng = random.Random('song-{}-{}'.format(seed, index))
+    artist = make_artist(profile, seed, rng.randrange(num_artists))
+    record = {'num_songs': 1}
+    record.update(artist)
+    record.update({'song_id': random_id(rng, 'SO'),
+                   'title': ' '.join(rng.choice(profile['title_words']) for _ in range(rng.randint(1, 4))),
+                   'duration': round(rng.choice(profile['durations']) * rng.uniform(0.8, 1.2), 5),
+                   'year': rng.choice(profile['years'])})
+    track_id = random_id(rng, 'TR')
+    return track_id, record
+
+
+def make_user(profile, seed, user_id):
+    """ Generates the user with the given id, the same seed and id always give the same user. """
+    rng = random.Random('user-{}-{}'.format(seed, user_id))
+    first_name, gender = rng.choice(profile['first_names'])
+    return {'firstName': first_name,
+            'gender': gender,
+            'lastName': rng.choice(profile['last_names']),
+            'location': rng.choice(profile['locations']),
+            'userAgent': rng.choice(profile['user_agents']),
+            'registration': float(rng.randint(1530000000000, 1540000000000)),
+            'level': 'paid' if rng.random() < profile['paid_ratio'] else 'free'}
+
+
+def zipf_rank(rng, n, s):
+    """ Draws a rank in [0, n) from a Zipf-like power law with exponent s, by inverting its continuous CDF. """
+    u = rng.random()
+    if abs(s - 1.0) < 1e-6:
+        rank = n ** u
+    else:
+        rank = ((n ** (1 - s) - 1) * u + 1) ** (1 / (1 - s))
+    return min(int(rank) - 1, n - 1)
+
+
+def write_songs(profile, options, first_index):
+    """ Writes the song files of a range of song indexes in the song_data/A/B/C/TRABC...json layout.
+
+    Returns:
+    num_files (int): The number of song files written.
+    """
+    last_index = min(first_index + songs_per_task, options['num_songs'])
+    for index in range(first_index, last_index):
+        track_id, record = make_song(profile, options['seed'], index, options['num_artists'])
+        song_dir = os.path.join(options['output_dir'], 'song_data', track_id[2], track_id[3], track_id[4])
+        os.makedirs(song_dir, exist_ok=True)
+        with open(os.path.join(song_dir, track_id + '.json'), 'w') as f:
+            json.dump(record, f)
+    return last_index - first_index
+
+
+def session_events(profile, options, day_index, session, start_ts, user_levels):
+    """ Generates the events of a session in time order, the same seed, day and session always give the same events.
+
+    Args:
+    profile (dict): Value pools and empirical distributions learned from the sample dataset.
+    options (dict): Generator options.
+    day_index (int): The index of the day from the start date.
+    session (int): The index of the session in the day.
+    start_ts (int): The timestamp of the first event in ms.
+    user_levels (dict): The current level of the users of the day, updated by upgrades and downgrades.
+
+    Yields:
+    event (dict): An event record of the log_data files.
+    """
+    rng = random.Random('session-{}-{}-{}'.format(options['seed'], day_index, session))
+    session_id = day_index * options['sessions_per_day'] + session + 1
+    user_id = rng.randint(1, options['num_users'])
+    user = make_user(profile, options['seed'], user_id)
+    ts = start_ts
+    for item in range(rng.choice(profile['session_lengths'])):
+        level = user_levels.setdefault(user_id, user['level'])
+        page = rng.choices(profile['pages'], weights=profile['page_weights'])[0]
+        method, status, logged_out_share = profile['page_attrs'][page]
+        logged_in = page == 'NextSong' or rng.random() >= logged_out_share
+        event = {'artist': None, 'auth': 'Logged In' if logged_in else 'Logged Out',
+                 'firstName': None, 'gender': None, 'itemInSession': item, 'lastName': None,
+                 'length': None, 'level': level, 'location': None, 'method': method, 'page': page,
+                 'registration': None, 'sessionId': session_id, 'song': None, 'status': status,
+                 'ts': ts, 'userAgent': None, 'userId': ''}
+        if logged_in:
+            event.update({key: user[key] for key in ('firstName', 'gender', 'lastName', 'location', 'userAgent', 'registration')})
+            event['userId'] = str(user_id)
+        if page == 'NextSong':
+            if rng.random() < options['match_ratio']:
+                index = zipf_rank(rng, options['num_songs'], profile['zipf_s'])
+                song = make_song(profile, options['seed'], index, options['num_artists'])[1]
+            else:
+                song = make_song(profile, options['seed'] + 1, rng.randrange(options['num_songs']), options['num_artists'])[1]
+            event.update({'artist': song['artist_name'], 'song': song['title'], 'length': song['duration']})
+        elif page == 'Submit Upgrade':
+            user_levels[user_id] = 'paid'
+        elif page == 'Submit Downgrade':
+            user_levels[user_id] = 'free'
+        yield event
+        ts += rng.choice(profile['gaps'])
+
+
+def day_events(profile, options, day_index, day_start):
+    """ Generates the events of a day in time order. Sessions are started in the order of their first event
+        and merged while they are active, so only the events of the overlapping sessions are held in memory.
+
+    Yields:
+    event (dict): An event record of the log_data files.
+    """
+    rng = random.Random('day-{}-{}'.format(options['seed'], day_index))
+    starts = sorted((day_start + rng.randrange(day_ms), session) for session in range(options['sessions_per_day']))
+    user_levels = {}
+    active = []
+    next_start = 0
+    while next_start < len(starts) or active:
+        # start the sessions whose first event comes before the next event of the active sessions
+        while next_start < len(starts) and (not active or starts[next_start][0] <= active[0][0]):
+            start_ts, session = starts[next_start]
+            events = session_events(profile, options, day_index, session, start_ts, user_levels)
+            event = next(events, None)
+            if event is not None:
+                heapq.heappush(active, (event['ts'], session, event, events))
+            next_start += 1
+        if not active:
+            continue
+        ts, session, event, events = heapq.heappop(active)
+        yield event
+        event = next(events, None)
+        if event is not None:
+            heapq.heappush(active, (event['ts'], session, event, events))
+
+
+def write_events(profile, options, day_index):
+    """ Streams the event log of a day to the log_data/YYYY/MM/YYYY-MM-DD-events.json layout
+        and, if enabled, to the event_data/YYYY-MM-DD-events.csv layout of the Cassandra project.
+
+    Returns:
+    num_events (int): The number of events written.
+    """
+    day = options['start_date'] + timedelta(days=day_index)
+    day_start = int(datetime(day.year, day.month, day.day, tzinfo=timezone.utc).timestamp() * 1000)
+    log_dir = os.path.join(options['output_dir'], 'log_data', '{:04d}'.format(day.year), '{:02d}'.format(day.month))
+    os.makedirs(log_dir, exist_ok=True)
+    csv_file = None
+    if options['event_csv']:
+        csv_dir = os.path.join(options['output_dir'], 'event_data')
+        os.makedirs(csv_dir, exist_ok=True)
+        csv_file = open(os.path.join(csv_dir, '{}-events.csv'.format(day.isoformat())), 'w', newline='')
+        writer = csv.DictWriter(csv_file, fieldnames=event_csv_columns, extrasaction='ignore')
+        writer.writeheader()
+    num_events = 0
+    try:
+        with open(os.path.join(log_dir, '{}-events.json'.format(day.isoformat())), 'w') as f:
+            for event in day_events(profile, options, day_index, day_start):
+                f.write(json.dumps(event, separators=(',', ':')) + '\n')
+                if csv_file is not None:
+                    writer.writerow(event)
+                num_events += 1
+    finally:
+        if csv_file is not None:
+            csv_file.close()
+    return num_events
+
+
+def run_task(profile, options, task):
+    """ Runs a song or a day task of the generator in a worker process. """
+    kind, value = task
+    if kind == 'songs':
+        return kind, write_songs(profile, options, value)
+    return kind, write_events(profile, options, value)
+
+
+def main(args):
+    """ Learns the sample dataset and generates a synthetic dataset of the configured size in parallel.
+
+    Args:
+    args.sample_dir (str): Directory of the sample dataset to learn from
+    args.output_dir (str): Directory to write song_data & log_data
+    args.num_songs (int): Number of song files
+    args.num_users (int): Number of users, defaults to the sample users scaled like the sessions
+    args.days (int): Number of daily event logs
+    args.start_date (str): First day of the event logs, YYYY-MM-DD
+    args.sessions_per_day (int): Number of sessions per day, defaults to the sample rate
+    args.match_ratio (float): Share of song plays that refer to a generated song file
+    args.workers (int): Number of worker processes
+    args.seed (int): Random seed, the same seed gives the same dataset
+    args.event_csv (bool): Also write the event logs as the event_data csv files of the Cassandra project
+    """
+    profile = learn_profile(args.sample_dir)
+    print('Learned the sample dataset: {:.1f} sessions/day, {} users, Zipf exponent of song popularity {:.2f}'.format(
+          profile['sessions_per_day'], profile['num_users'], profile['zipf_s']))
+
+    sessions_per_day = args.sessions_per_day or max(1, round(profile['sessions_per_day']))
+    scale = sessions_per_day / profile['sessions_per_day']
+    options = {'output_dir': args.output_dir,
+               'seed': args.seed,
+               'num_songs': args.num_songs,
+               'num_artists': max(1, round(args.num_songs / profile['songs_per_artist'])),
+               'num_users': args.num_users or max(1, round(profile['num_users'] * scale)),
+               'sessions_per_day': sessions_per_day,
+               'start_date': datetime.strptime(args.start_date, '%Y-%m-%d').date(),
+               'match_ratio': args.match_ratio,
+               'event_csv': args.event_csv}
+
+    tasks = [('songs', index) for index in range(0, args.num_songs, songs_per_task)] + \
+            [('events', day) for day in range(args.days)]
+    totals = collections.Counter()
+    with multiprocessing.Pool(args.workers) as pool:
+        for kind, count in pool.imap_unordered(functools.partial(run_task, profile, options), tasks):
+            totals[kind] += count
+            print('{} song files and {} events written'.format(totals['songs'], totals['events']))
+    print('Synthetic dataset is written to {}'.format(args.output_dir))
+
+
+if __name__ == "__main__":
+    # Parse arguments
+    parser = argparse.ArgumentParser(description="Generates a synthetic Sparkify dataset learned from the sample data")
+    parser.add_argument("--sample-dir", default='data', help="Directory of the sample dataset to learn from")
+    parser.add_argument("--output-dir", default='synthetic_data', help="Directory to write song_data & log_data")
+    parser.add_argument("--num-songs", type=int, default=10000, help="Number of song files")
+    parser.add_argument("--num-users", type=int, help="Number of users")
+    parser.add_argument("--days", type=int, default=30, help="Number of daily event logs")
+    parser.add_argument("--start-date", default='2018-11-01', help="First day of the event logs, YYYY-MM-DD")
+    parser.add_argument("--sessions-per-day", type=int, help="Number of sessions per day")
+    parser.add_argument("--match-ratio", type=float, default=1.0, help="Share of song plays that refer to a generated song file")
+    parser.add_argument("--workers", type=int, default=multiprocessing.cpu_count(), help="Number of worker processes")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed")
+    parser.add_argument("--event-csv", help="Also write the event logs as event_data csv files for the Cassandra project", action="store_true")
+    args = parser.parse_args()
+
+    main(args)
@@ -0,0 +1,110 @@
+import pandas as pd
+from sql_queries import song_lookup_select, artist_lookup_select
+
+
+class SongLookup:
+    """ In-memory index of songs keyed on (title, artist name, duration).
+    
+    It mirrors the songs & artists tables, so the song and artist ids of songplays
+    can be resolved with a single pandas merge instead of one `song_select` query per row.
+    
+    Songs added from song files are staged until the transaction that inserts them is committed,
+    so a rolled back song file never leaves songs in the index that are missing from the tables.
+    """
+
+    song_columns = ['song_id', 'title', 'artist_id', 'duration']
+    artist_columns = ['artist_id', 'name']
+    key_columns = ['title', 'name', 'duration']
+
+    def __init__(self):
+        self.songs = pd.DataFrame(columns=self.song_columns)
+        self.artists = pd.DataFrame(columns=self.artist_columns)
+        self.pending_songs = []
+        self.pending_artists = []
+        self.staged = []
+        self.released = []
+        self.index = None
+
+    def load(self, cur):
+        """ Loads all songs and artists already in the database.
+        
+        Args:
+        cur (psycopg2 cursor): The cursor object to interact with the database.
+        """
+        cur.execute(song_lookup_select)
+        songs = pd.DataFrame(cur.fetchall(), columns=self.song_columns)
+        cur.execute(artist_lookup_select)
+        artists = pd.DataFrame(cur.fetchall(), columns=self.artist_columns)
+        self.add(songs, artists)
+
+    def add(self, songs, artists):
+        """ Adds newly inserted songs and artists to the index.
+        
+        Args:
+        songs (pandas DataFrame): Rows with song_id, title, artist_id & duration columns.
+        artists (pandas DataFrame): Rows with artist_id & name columns.
+        """
+        self.pending_songs.append(songs[self.song_columns])
+        self.pending_artists.append(artists[self.artist_columns])
+        self.index = None
+
+    def add_song_df(self, df):
+        """ Stages the records of a song file DataFrame, they are added to the index when the transaction is committed.
+        
+        Args:
+        df (pandas DataFrame): Song records as read from the song files.
+        """
+        self.staged.append((df[['song_id', 'title', 'artist_id', 'duration']],
+                            df[['artist_id', 'artist_name']].rename(columns={'artist_name': 'name'})))
+
+    def release(self):
+        """ Keeps the staged songs of a file whose savepoint is released, until the transaction is committed. """
+        self.released.extend(self.staged)
+        self.staged = []
+
+    def commit(self):
+        """ Adds the staged songs to the index after the transaction is committed. """
+        self.release()
+        for songs, artists in self.released:
+            self.add(songs, artists)
+        self.released = []
+
+    def rollback(self):
+        """ Forgets the staged songs of the file that is rolled back, the songs of the earlier files of the transaction are kept. """
+        self.staged = []
+
+    def build_index(self):
+        """ Merges the pending rows and rebuilds the (title, artist name, duration) index. """
+        if self.pending_songs:
+            # the first row wins like 'ON CONFLICT DO NOTHING' in the songs & artists tables
+            self.songs = pd.concat([self.songs] + self.pending_songs, ignore_index=True) \
+                           .drop_duplicates(subset='song_id', keep='first')
+            self.artists = pd.concat([self.artists] + self.pending_artists, ignore_index=True) \
+                             .drop_duplicates(subset='artist_id', keep='first')
+            self.pending_songs, self.pending_artists = [], []
+        index = self.songs.merge(self.artists, on='artist_id')
+        index['duration'] = index['duration'].astype(float)
+        self.index = index.dropna(subset=self.key_columns).drop_duplicates(subset=self.key_columns, keep='first')
+
+    def resolve(self, df, title='song', artist='artist', duration='length'):
+        """ Finds the song and artist ids of each row in a log DataFrame.
+        
+        Args:
+        df (pandas DataFrame): Log records.
+        title (str): The column with song title.
+        artist (str): The column with artist name.
+        duration (str): The column with song duration.
+        
+        Returns:
+        df (pandas DataFrame): A copy of the log records with song_id & artist_id columns, None where there is no match.
+        """
+        if self.index is None:
+            self.build_index()
+        keys = df[[title, artist, duration]].astype({duration: float})
+        keys.columns = self.key_columns
+        matches = keys.merge(self.index[self.key_columns + ['song_id', 'artist_id']], how='left', on=self.key_columns)
+        df = df.copy()
+        for column in ['song_id', 'artist_id']:
+            ids = matches[column].astype(object)
+            df[column] = ids.where(ids.notnull(), None).values
+        return df
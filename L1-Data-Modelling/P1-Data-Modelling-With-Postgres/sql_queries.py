@@ -5,16 +5,19 @@ user_table_drop = "DROP TABLE IF EXISTS users"
 song_table_drop = "DROP TABLE IF EXISTS songs"
 artist_table_drop = "DROP TABLE IF EXISTS artists"
 time_table_drop = "DROP TABLE IF EXISTS time"
+manifest_table_drop = "DROP TABLE IF EXISTS ingest_manifest"
 
 # CREATE TABLES
 
+# The foreign keys of songplays are added separately by the queries in `songplay_foreign_key_queries`,
+# so that an initial bulk load can defer them until all the data is loaded.
 songplay_table_create = ("CREATE TABLE IF NOT EXISTS songplays \
                          (songplay_id bigserial PRIMARY KEY, \
-                          start_time bigint NOT NULL REFERENCES time(start_time), \
-                          user_id int NOT NULL REFERENCES users(user_id), \
+                          start_time bigint NOT NULL, \
+                          user_id int NOT NULL, \
                           level varchar NOT NULL, \
-                          song_id varchar REFERENCES songs(song_id), \
-                          artist_id varchar REFERENCES artists(artist_id), \
+                          song_id varchar, \
+                          artist_id varchar, \
                           session_id int NOT NULL, \
                           location varchar, \
                           user_agent varchar );")
@@ -49,6 +52,67 @@ time_table_create = ("CREATE TABLE IF NOT EXISTS time \
                       year int NOT NULL, \
                       weekday smallint NOT NULL);")
 
+# Range-partitioned songplays by month of start_time, the partition key has to be part of the primary key.
+songplay_table_partitioned_create = ("CREATE TABLE IF NOT EXISTS songplays \
+                                     (songplay_id bigserial, \
+                                      start_time bigint NOT NULL, \
+                                      user_id int NOT NULL, \
+                                      level varchar NOT NULL, \
+                                      song_id varchar, \
+                                      artist_id varchar, \
+                                      session_id int NOT NULL, \
+                                      location varchar, \
+                                      user_agent varchar, \
+                                      PRIMARY KEY (songplay_id, start_time)) \
+                                     PARTITION BY RANGE (start_time);")
+
+songplay_partition_create = ("CREATE TABLE IF NOT EXISTS {} PARTITION OF songplays FOR VALUES FROM ({}) TO ({});")
+
+songplay_default_partition_create = ("CREATE TABLE IF NOT EXISTS songplays_default PARTITION OF songplays DEFAULT;")
+
+manifest_table_create = ("CREATE TABLE IF NOT EXISTS ingest_manifest \
+                         (path varchar PRIMARY KEY, \
+                          size bigint NOT NULL, \
+                          mtime double precision NOT NULL, \
+                          content_hash varchar NOT NULL, \
+                          processed_at timestamp NOT NULL DEFAULT now());")
+
+# FOREIGN KEYS
+# Named as Postgres names the constraints of inline REFERENCES clauses.
+# A constraint that already exists is skipped, so they can be added again after any load.
+
+songplay_fk_create = ("DO $$ BEGIN \
+                           IF NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conrelid = 'songplays'::regclass AND conname = '{0}') THEN \
+                               ALTER TABLE songplays ADD CONSTRAINT {0} FOREIGN KEY ({1}) REFERENCES {2}; \
+                           END IF; \
+                       END $$;")
+
+songplay_time_fk_create = songplay_fk_create.format('songplays_start_time_fkey', 'start_time', 'time(start_time)')
+
+songplay_user_fk_create = songplay_fk_create.format('songplays_user_id_fkey', 'user_id', 'users(user_id)')
+
+songplay_song_fk_create = songplay_fk_create.format('songplays_song_id_fkey', 'song_id', 'songs(song_id)')
+
+songplay_artist_fk_create = songplay_fk_create.format('songplays_artist_id_fkey', 'artist_id', 'artists(artist_id)')
+
+# CREATE INDEXES
+
+song_title_duration_index_create = ("CREATE INDEX IF NOT EXISTS songs_title_duration_idx ON songs (title, duration);")
+
+artist_name_index_create = ("CREATE INDEX IF NOT EXISTS artists_name_idx ON artists (name);")
+
+songplay_start_time_index_create = ("CREATE INDEX IF NOT EXISTS songplays_start_time_idx ON songplays (start_time);")
+
+songplay_user_index_create = ("CREATE INDEX IF NOT EXISTS songplays_user_id_idx ON songplays (user_id);")
+
+songplay_song_index_create = ("CREATE INDEX IF NOT EXISTS songplays_song_id_idx ON songplays (song_id);")
+
+songplay_artist_index_create = ("CREATE INDEX IF NOT EXISTS songplays_artist_id_idx ON songplays (artist_id);")
+
+# UPDATE STATISTICS
+
+tables_analyze = ("ANALYZE songplays, users, songs, artists, time;")
+
 # INSERT RECORDS
 
 songplay_table_insert = ("INSERT INTO songplays (start_time, user_id, level, song_id, artist_id, session_id, location, user_agent) VALUES (%s,%s,%s,%s,%s,%s,%s,%s)")
@@ -65,12 +129,102 @@ artist_table_insert = ("INSERT INTO artists (artist_id, name, location, latitude
 time_table_insert = ("INSERT INTO time (start_time, hour, day, week, month, year, weekday) VALUES (%s,%s,%s,%s,%s,%s,%s) \
                       ON CONFLICT (start_time) DO NOTHING")
 
+# Multi-row inserts for a batch of song files, the VALUES list is filled in by psycopg2.extras.execute_values
+
+song_table_batch_insert = ("INSERT INTO songs (song_id, title, artist_id, year, duration) VALUES %s \
+                            ON CONFLICT (song_id) DO NOTHING")
+
+artist_table_batch_insert = ("INSERT INTO artists (artist_id, name, location, latitude, longitude) VALUES %s \
+                              ON CONFLICT (artist_id) DO NOTHING")
+
+# BULK LOAD
+# Temporary tables that receive each batch through COPY FROM STDIN before it is merged into the final tables.
+
+time_tmp_table_create = ("CREATE TEMP TABLE IF NOT EXISTS time_tmp \
+                         (start_time bigint, \
+                          hour smallint, \
+                          day smallint, \
+                          week smallint, \
+                          month smallint, \
+                          year int, \
+                          weekday smallint);")
+
+user_tmp_table_create = ("CREATE TEMP TABLE IF NOT EXISTS users_tmp \
+                         (user_id int, \
+                          first_name varchar, \
+                          last_name varchar, \
+                          gender varchar, \
+                          level varchar);")
+
+songplay_tmp_table_create = ("CREATE TEMP TABLE IF NOT EXISTS songplays_tmp \
+                             (start_time bigint, \
+                              user_id int, \
+                              level varchar, \
+                              song varchar, \
+                              artist varchar, \
+                              length double precision, \
+                              session_id int, \
+                              location varchar, \
+                              user_agent varchar);")
+
+tmp_tables_truncate = "TRUNCATE time_tmp, users_tmp, songplays_tmp"
+
+# Set-based merges from the temporary tables, keeping the upsert semantics of the row-at-a-time inserts above.
+
+time_table_bulk_insert = ("INSERT INTO time (start_time, hour, day, week, month, year, weekday) \
+                           SELECT start_time, hour, day, week, month, year, weekday FROM time_tmp \
+                           ON CONFLICT (start_time) DO NOTHING")
+
+user_table_bulk_insert = ("INSERT INTO users (user_id, first_name, last_name, gender, level) \
+                           SELECT user_id, first_name, last_name, gender, level FROM users_tmp ORDER BY user_id \
+                           ON CONFLICT (user_id) DO UPDATE SET level=EXCLUDED.level")
+
+songplay_table_bulk_insert = ("INSERT INTO songplays (start_time, user_id, level, song_id, artist_id, session_id, location, user_agent) \
+                               SELECT t.start_time, t.user_id, t.level, s.song_id, s.artist_id, t.session_id, t.location, t.user_agent \
+                               FROM songplays_tmp t \
+                               LEFT JOIN LATERAL (SELECT song_id, songs.artist_id FROM songs JOIN artists ON songs.artist_id = artists.artist_id \
+                                                  WHERE title = t.song AND name = t.artist AND duration = t.length LIMIT 1) s ON true")
+
+# INGESTION MANIFEST
+
+manifest_select = ("SELECT path, size, mtime, content_hash FROM ingest_manifest")
+
+manifest_upsert = ("INSERT INTO ingest_manifest (path, size, mtime, content_hash) VALUES (%s,%s,%s,%s) \
+                    ON CONFLICT (path) DO UPDATE SET size=EXCLUDED.size, mtime=EXCLUDED.mtime, \
+                    content_hash=EXCLUDED.content_hash, processed_at=now()")
+
+# Songplays loaded without a manifest, e.g. by an ETL version that only recorded the files of incremental runs
+songplay_exists_select = ("SELECT EXISTS (SELECT 1 FROM songplays)")
+
+# TRANSACTION CONTROL
+# Each file gets its own savepoint when several files share a transaction.
+
+file_savepoint = ("SAVEPOINT etl_file")
+
+file_savepoint_release = ("RELEASE SAVEPOINT etl_file")
+
+file_savepoint_rollback = ("ROLLBACK TO SAVEPOINT etl_file")
+
 # FIND SONGS
 
 song_select = ("SELECT song_id, songs.artist_id FROM songs JOIN artists ON songs.artist_id = artists.artist_id \
                 WHERE title = %s AND name = %s AND duration = %s")
 
+# SONG LOOKUP
+
+song_lookup_select = ("SELECT song_id, title, artist_id, duration FROM songs")
+
+artist_lookup_select = ("SELECT artist_id, name FROM artists")
+
+# TIME CACHE
+
+time_start_select = ("SELECT start_time FROM time")
+
 # QUERY LISTS
 
-create_table_queries = [artist_table_create, song_table_create, user_table_create, time_table_create, songplay_table_create]
-drop_table_queries = [songplay_table_drop, user_table_drop, time_table_drop, artist_table_drop, song_table_drop]
\ No newline at end of file
+create_table_queries = [artist_table_create, song_table_create, user_table_create, time_table_create, songplay_table_create, manifest_table_create]
+drop_table_queries = [songplay_table_drop, user_table_drop, time_table_drop, artist_table_drop, song_table_drop, manifest_table_drop]
+songplay_foreign_key_queries = [songplay_time_fk_create, songplay_user_fk_create, songplay_song_fk_create, songplay_artist_fk_create]
+create_index_queries = [song_title_duration_index_create, artist_name_index_create, songplay_start_time_index_create,
+                        songplay_user_index_create, songplay_song_index_create, songplay_artist_index_create]
+tmp_table_create_queries = [time_tmp_table_create, user_tmp_table_create, songplay_tmp_table_create]
\ No newline at end of file
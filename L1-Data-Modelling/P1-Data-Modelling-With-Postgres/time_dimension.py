@@ -0,0 +1,73 @@
+import pandas as pd
+
+# Columns of the time table
+time_columns = ['start_time', 'hour', 'day', 'week', 'month', 'year', 'weekday']
+
+
+def build_time_table(ts):
+    """ Computes the columns of the time table for unix timestamps in one vectorized pass.
+        It only depends on pandas, so it can be reused by any pipeline that holds the timestamps in a pandas Series.
+    
+    Args:
+    ts (pandas Series): Unix timestamps in ms.
+    
+    Returns:
+    time_df (pandas DataFrame): One row per timestamp with start_time, hour, day, ISO week, month, year & weekday (Monday=0).
+    """
+    ts = pd.Series(ts, dtype='int64').reset_index(drop=True)
+    t = pd.to_datetime(ts, unit='ms')
+    return pd.DataFrame({'start_time': ts,
+                         'hour': t.dt.hour,
+                         'day': t.dt.day,
+                         'week': t.dt.isocalendar()['week'].astype('int64'),
+                         'month': t.dt.month,
+                         'year': t.dt.year,
+                         'weekday': t.dt.weekday}, columns=time_columns)
+
+
+class TimeDimension:
+    """ Builds the rows of the time table and dedupes them client-side against the start_times already loaded.
+    
+    New start_times are kept as pending until the transaction that inserts them is committed,
+    so a rolled back transaction never leaves a start_time in the cache that is missing from the table.
+    
+    Args:
+    start_time_select (str): The query that selects the start_times already in the time table of the pipeline.
+    """
+
+    def __init__(self, start_time_select):
+        self.start_time_select = start_time_select
+        self.loaded = set()
+        self.pending = set()
+
+    def load(self, cur):
+        """ Loads the start_times already in the time table.
+        
+        Args:
+        cur (psycopg2 cursor): The cursor object to interact with the database.
+        """
+        cur.execute(self.start_time_select)
+        self.loaded.update(row[0] for row in cur)
+
+    def new_rows(self, ts):
+        """ Builds the time rows of the timestamps that are neither loaded nor pending.
+        
+        Args:
+        ts (pandas Series): Unix timestamps in ms, may contain duplicates.
+        
+        Returns:
+        time_df (pandas DataFrame): The rows to insert into the time table.
+        """
+        ts = pd.Series(ts).dropna().astype('int64').drop_duplicates()
+        ts = ts[~ts.isin(self.loaded) & ~ts.isin(self.pending)]
+        self.pending.update(ts.tolist())
+        return build_time_table(ts)
+
+    def commit(self):
+        """ Marks the pending start_times as loaded after the transaction is committed. """
+        self.loaded.update(self.pending)
+        self.pending.clear()
+
+    def rollback(self):
+        """ Forgets the pending start_times after the transaction is rolled back. """
+        self.pending.clear()
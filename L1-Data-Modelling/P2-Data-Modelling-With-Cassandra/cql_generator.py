@@ -0,0 +1,107 @@
+import operator
+
+# A query table is declared by the query it serves:
+#   'table'      : name of the table
+#   'filter'     : columns in the WHERE clause, all with equality
+#   'clustering' : (column, 'ASC' or 'DESC') pairs the rows of a partition are sorted by
+#   'select'     : columns returned by the query
+# The filter columns that are not clustering columns make up the partition key, and the
+# table stores the partition key, the clustering columns and the selected columns.
+
+
+def partition_key(spec):
+    """ Returns the partition key columns of a query table spec. """
+    clustering = [column for column, order in spec['clustering']]
+    return [column for column in spec['filter'] if column not in clustering]
+
+
+def table_columns(spec):
+    """ Returns the columns of a query table in order: partition key, clustering columns and selected columns. """
+    columns = partition_key(spec) + [column for column, order in spec['clustering']]
+    return columns + [column for column in spec['select'] if column not in columns]
+
+
+def validate_spec(spec, column_types):
+    """ Checks that the query of a spec can be served by the table derived from it.
+
+    Args:
+    spec (dict): The query table spec.
+    column_types (dict): CQL types of the columns.
+
+    Raises:
+    ValueError: If the query would need filtering or a column has no type.
+    """
+    if not partition_key(spec):
+        raise ValueError('{}: the filter must have at least one column that is not a clustering column'.format(spec['table']))
+    clustering = [column for column, order in spec['clustering']]
+    filtered = [column for column in spec['filter'] if column in clustering]
+    if filtered != clustering[:len(filtered)]:
+        raise ValueError('{}: filtered clustering columns must be a prefix of {}'.format(spec['table'], clustering))
+    for column, order in spec['clustering']:
+        if order not in ('ASC', 'DESC'):
+            raise ValueError('{}: unknown clustering order {} of {}'.format(spec['table'], order, column))
+    for column in table_columns(spec):
+        if column not in column_types:
+            raise ValueError('{}: no type for column {}'.format(spec['table'], column))
+
+
+def create_table_query(spec, column_types):
+    """ Derives the CREATE TABLE query of a query table spec.
+
+    Args:
+    spec (dict): The query table spec.
+    column_types (dict): CQL types of the columns.
+
+    Returns:
+    query (str): The CREATE TABLE query.
+    """
+    validate_spec(spec, column_types)
+    columns = ', '.join('{} {}'.format(column, column_types[column]) for column in table_columns(spec))
+    key = partition_key(spec)
+    key = key[0] if len(key) == 1 else '({})'.format(', '.join(key))
+    primary_key = ', '.join([key] + [column for column, order in spec['clustering']])
+    query = 'CREATE TABLE IF NOT EXISTS {} ({}, PRIMARY KEY ({}))'.format(spec['table'], columns, primary_key)
+    if spec['clustering']:
+        order = ', '.join('{} {}'.format(column, order) for column, order in spec['clustering'])
+        query += ' WITH CLUSTERING ORDER BY ({})'.format(order)
+    return query
+
+
+def drop_table_query(spec):
+    """ Derives the DROP TABLE query of a query table spec. """
+    return 'DROP TABLE IF EXISTS {}'.format(spec['table'])
+
+
+def insert_query(spec):
+    """ Derives the INSERT query of a query table spec, with ? markers to be prepared. """
+    columns = table_columns(spec)
+    return 'INSERT INTO {} ({}) VALUES ({})'.format(spec['table'], ', '.join(columns), ', '.join('?' * len(columns)))
+
+
+def select_query(spec):
+    """ Derives the SELECT query of a query table spec, with a ? marker for each filter column to be prepared. """
+    where = ' AND '.join('{} = ?'.format(column) for column in spec['filter'])
+    return 'SELECT {} FROM {} WHERE {}'.format(', '.join(spec['select']), spec['table'], where)
+
+
+def row_getter(columns):
+    """ Returns a function that takes the values of the columns from an event as a tuple. """
+    if len(columns) == 1:
+        column = columns[0]
+        return lambda event: (event[column],)
+    return operator.itemgetter(*columns)
+
+
+def table_loader(spec):
+    """ Derives what the loader needs to load a query table from the events.
+
+    Args:
+    spec (dict): The query table spec.
+
+    Returns:
+    table (dict): Name, insert query, and the functions that return the partition key and the values of the row of an event.
+    """
+    return {'name': spec['table'],
+            'insert': insert_query(spec),
+            'partition_key': row_getter(partition_key(spec)),
+            'values': row_getter(table_columns(spec))}
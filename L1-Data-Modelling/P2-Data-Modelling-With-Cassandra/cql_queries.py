@@ -0,0 +1,49 @@
+from cql_generator import create_table_query, drop_table_query, insert_query, select_query
+
+# KEYSPACE
+
+keyspace_create = ("CREATE KEYSPACE IF NOT EXISTS sparkify_analytics \
+                    WITH REPLICATION = \
+                    { 'class' : 'SimpleStrategy', 'replication_factor' : 1 }")
+
+# COLUMNS
+# CQL types of the columns of the event data, shared by all query tables
+
+column_types = {'session_id': 'bigint',
+                'item_in_session': 'int',
+                'artist_name': 'text',
+                'song_title': 'text',
+                'songs_length': 'decimal',
+                'user_id': 'bigint',
+                'user_firstname': 'text',
+                'user_lastname': 'text'}
+
+# QUERY TABLES
+# Each table is declared by the query it serves, the queries below are derived by cql_generator.py
+
+# 1. Artist, song title and song's length heard during a session at an item in session
+songs_by_session = {'table': 'songs_by_session',
+                    'filter': ['session_id', 'item_in_session'],
+                    'clustering': [('item_in_session', 'ASC')],
+                    'select': ['artist_name', 'song_title', 'songs_length']}
+
+# 2. Artist, song (sorted by item in session) and user name of a user in a session
+songs_by_user = {'table': 'songs_by_user',
+                 'filter': ['user_id', 'session_id'],
+                 'clustering': [('item_in_session', 'ASC')],
+                 'select': ['artist_name', 'song_title', 'user_firstname', 'user_lastname']}
+
+# 3. Every user (first and last name) who listened to a song, users are identified by user_id
+users_by_song = {'table': 'users_by_song',
+                 'filter': ['song_title'],
+                 'clustering': [('user_id', 'ASC')],
+                 'select': ['user_id', 'user_firstname', 'user_lastname']}
+
+query_specs = [songs_by_session, songs_by_user, users_by_song]
+
+# QUERY LISTS
+
+create_table_queries = [create_table_query(spec, column_types) for spec in query_specs]
+drop_table_queries = [drop_table_query(spec) for spec in query_specs]
+insert_queries = {spec['table']: insert_query(spec) for spec in query_specs}
+select_queries = {spec['table']: select_query(spec) for spec in query_specs}
@@ -0,0 +1,192 @@
+import argparse
+import csv
+from decimal import Decimal
+from cassandra.cluster import Cluster
+from cassandra.concurrent import execute_concurrent
+from cassandra.query import BatchStatement, BatchType
+from cql_generator import table_loader
+from cql_queries import *
+from queries import execution_profiles
+
+# Query tables loaded from the event file, each with its insert query and
+# the partition key and the values of the row of an event
+query_tables = [table_loader(spec) for spec in query_specs]
+
+
+def create_session(hosts, keyspace='sparkify_analytics'):
+    """ Connects to the Apache Cassandra cluster and sets the keyspace, which is created if it does not exist.
+
+    Args:
+    hosts (list): Contact points of the cluster.
+    keyspace (str): The keyspace of the tables.
+
+    Returns:
+    cluster (cassandra Cluster): The cluster object.
+    session (cassandra Session): The session to execute the queries.
+    """
+    cluster = Cluster(hosts, execution_profiles=execution_profiles())
+    session = cluster.connect()
+    session.execute(keyspace_create)
+    session.set_keyspace(keyspace)
+    return cluster, session
+
+
+def create_tables(session, reset=False):
+    """ Creates the query tables, the existing tables are dropped first if reset is set. """
+    if reset:
+        for query in drop_table_queries:
+            session.execute(query)
+    for query in create_table_queries:
+        session.execute(query)
+
+
+def parse_event(line):
+    """ Converts a line of event_datafile_new.csv to the typed values of the query tables.
+
+    Args:
+    line (list): The csv fields of the line.
+
+    Returns:
+    event (dict): The values keyed on the column names of the query tables.
+    """
+    return {'artist_name': line[0],
+            'user_firstname': line[1],
+            'item_in_session': int(line[3]),
+            'user_lastname': line[4],
+            'songs_length': Decimal(line[5]),
+            'session_id': int(line[8]),
+            'song_title': line[9],
+            'user_id': int(line[10])}
+
+
+def read_event_chunks(filepath, chunk_size):
+    """ Reads the consolidated event file once and yields its events in chunks.
+
+    Args:
+    filepath (str): The path of the event file.
+    chunk_size (int): The number of events in a chunk.
+
+    Returns:
+    chunks (generator): Lists of events parsed by `parse_event`.
+    """
+    with open(filepath, encoding='utf8') as f:
+        csvreader = csv.reader(f)
+        next(csvreader) # skip header
+        chunk = []
+        for line in csvreader:
+            chunk.append(parse_event(line))
+            if len(chunk) == chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+
+def batch_statements(prepared, events, partition_key, values, max_batch_size):
+    """ Groups the rows of a table by partition key into unlogged batches.
+        A batch only holds rows of a single partition, so it is applied by one replica set
+        without the coordinator overhead of a multi-partition batch.
+
+    Args:
+    prepared (cassandra PreparedStatement): The prepared insert query of the table.
+    events (list): The events of a chunk.
+    partition_key (function): Returns the partition key of the row of an event.
+    values (function): Returns the values of the row of an event.
+    max_batch_size (int): The maximum number of rows in a batch.
+
+    Returns:
+    statements (list): (statement, parameters) pairs to execute.
+    """
+    partitions = {}
+    for event in events:
+        partitions.setdefault(partition_key(event), []).append(values(event))
+
+    statements = []
+    for rows in partitions.values():
+        for i in range(0, len(rows), max_batch_size):
+            batch_rows = rows[i:i + max_batch_size]
+            if len(batch_rows) == 1:
+                statements.append((prepared, batch_rows[0]))
+                continue
+            batch = BatchStatement(batch_type=BatchType.UNLOGGED)
+            for row in batch_rows:
+                batch.add(prepared, row)
+            statements.append((batch, ()))
+    return statements
+
+
+def load_event_file(session, filepath, chunk_size=10000, concurrency=64, max_batch_size=50):
+    """ Loads the event file into all query tables in a single pass over the file.
+        The inserts are prepared once and the batches of a chunk are executed concurrently.
+
+    Args:
+    session (cassandra Session): The session to execute the queries.
+    filepath (str): The path of the event file.
+    chunk_size (int): The number of events grouped and loaded together.
+    concurrency (int): The maximum number of requests in flight.
+    max_batch_size (int): The maximum number of rows in a batch.
+
+    Returns:
+    num_rows (dict): The number of rows loaded into each table.
+    num_failed (dict): The number of rows of each table whose insert or batch failed.
+    """
+    prepared = [session.prepare(table['insert']) for table in query_tables]
+    num_rows = {table['name']: 0 for table in query_tables}
+    num_failed = {table['name']: 0 for table in query_tables}
+    for events in read_event_chunks(filepath, chunk_size):
+        # the statements of all tables run together, so a chunk is read once and loaded into every table
+        statements, names = [], []
+        for table, statement in zip(query_tables, prepared):
+            table_statements = batch_statements(statement, events, table['partition_key'], table['values'], max_batch_size)
+            statements += table_statements
+            names += [table['name']] * len(table_statements)
+        results = execute_concurrent(session, statements, concurrency=concurrency, raise_on_first_error=False)
+        for name, (statement, parameters), (success, result) in zip(names, statements, results):
+            rows = len(statement) if isinstance(statement, BatchStatement) else 1
+            if success:
+                num_rows[name] += rows
+            else:
+                print('{}: {} rows failed: {}'.format(name, rows, result))
+                num_failed[name] += rows
+        print('{} rows loaded from {}'.format(sum(num_rows.values()), filepath))
+    return num_rows, num_failed
+
+
+def main(args):
+    """ Creates the query tables in Apache Cassandra and loads the consolidated event files into them.
+
+    Args:
+    args.hosts (list): Contact points of the Apache Cassandra cluster
+    args.files (list): The consolidated event files
+    args.reset (boolean): Drops and recreates the tables before loading
+    args.chunk_size (int): The number of events grouped and loaded together
+    args.concurrency (int): The maximum number of requests in flight
+    args.batch_size (int): The maximum number of rows in an unlogged batch
+    """
+    cluster, session = create_session(args.hosts)
+    create_tables(session, reset=args.reset)
+    total_failed = 0
+    for filepath in args.files:
+        num_rows, num_failed = load_event_file(session, filepath, chunk_size=args.chunk_size,
+                                               concurrency=args.concurrency, max_batch_size=args.batch_size)
+        for table, count in num_rows.items():
+            print('{}: {} rows loaded, {} rows failed from {}'.format(table, count, num_failed[table], filepath))
+        total_failed += sum(num_failed.values())
+    session.shutdown()
+    cluster.shutdown()
+    if total_failed:
+        raise SystemExit('{} rows failed to load'.format(total_failed))
+
+
+if __name__ == "__main__":
+    # Parse arguments
+    parser = argparse.ArgumentParser(description="Loads the Sparkify event data into Apache Cassandra query tables")
+    parser.add_argument("--hosts", nargs='+', default=['127.0.0.1'], help="Contact points of the Apache Cassandra cluster")
+    parser.add_argument("--files", nargs='+', default=['event_datafile_new.csv'], help="Consolidated event files")
+    parser.add_argument("--reset", help="Drop and recreate the tables before loading", action="store_true")
+    parser.add_argument("--chunk-size", type=int, default=10000, help="Number of events grouped and loaded together")
+    parser.add_argument("--concurrency", type=int, default=64, help="Maximum number of requests in flight")
+    parser.add_argument("--batch-size", type=int, default=50, help="Maximum number of rows in an unlogged batch")
+    args = parser.parse_args()
+
+    main(args)
@@ -0,0 +1,166 @@
+import argparse
+import collections
+import csv
+import glob
+import multiprocessing
+import os
+
+# Columns of the consolidated event file and their positions in the event_data files
+event_columns = ['artist', 'firstName', 'gender', 'itemInSession', 'lastName', 'length',
+                 'level', 'location', 'sessionId', 'song', 'userId']
+event_column_indexes = [0, 2, 3, 4, 5, 6, 7, 8, 12, 13, 16]
+session_index = event_columns.index('sessionId')
+
+csv.register_dialect('myDialect', quoting=csv.QUOTE_ALL, skipinitialspace=True)
+
+
+def get_event_files(filepath):
+    """ Collects the event csv files under a directory in a fixed order.
+
+    Args:
+    filepath (str): The directory of the event data files.
+
+    Returns:
+    file_path_list (list): Sorted paths of the csv files.
+    """
+    return sorted(glob.glob(os.path.join(filepath, '**', '*.csv'), recursive=True))
+
+
+def read_event_rows(filepath):
+    """ Reads an event csv file line by line and yields the consolidated columns of the rows with an artist.
+
+    Args:
+    filepath (str): The path of the event csv file.
+
+    Returns:
+    rows (generator): Rows with the columns in `event_columns`.
+    """
+    with open(filepath, 'r', encoding='utf8', newline='') as csvfile:
+        csvreader = csv.reader(csvfile)
+        next(csvreader, None) # skip header
+        for line in csvreader:
+            if line[0] == '':
+                continue
+            yield [line[i] for i in event_column_indexes]
+
+
+def read_event_file(filepath):
+    """ Reads and filters a single event file in a worker process, only the rows kept are sent back. """
+    return list(read_event_rows(filepath))
+
+
+def read_event_files_parallel(pool, file_path_list, window):
+    """ Reads and filters the event files on a pool of worker processes, with at most `window` files in flight.
+        The results are yielded in the order of the files, and a file is only submitted after an earlier one is
+        taken, so a slow file or a slow writer cannot pile up the rows of many files in this process.
+
+    Args:
+    pool (multiprocessing.Pool): The worker processes.
+    file_path_list (list): Paths of the event csv files.
+    window (int): The number of files submitted to the pool but not yet taken.
+
+    Returns:
+    file_rows (generator): The kept rows of each file.
+    """
+    pending = collections.deque()
+    files = iter(file_path_list)
+    for filepath in files:
+        pending.append(pool.apply_async(read_event_file, (filepath,)))
+        if len(pending) == window:
+            break
+    while pending:
+        rows = pending.popleft().get()
+        filepath = next(files, None)
+        if filepath is not None:
+            pending.append(pool.apply_async(read_event_file, (filepath,)))
+        yield rows
+
+
+def write_event_rows(writers, file_rows):
+    """ Writes the rows of each file to the partition of their sessionId.
+
+    Args:
+    writers (list): csv writers of the partitions.
+    file_rows (iterable): The kept rows of each file.
+
+    Returns:
+    num_rows (int): The number of rows written.
+    """
+    num_rows = 0
+    for rows in file_rows:
+        for row in rows:
+            writers[int(row[session_index]) % len(writers)].writerow(row)
+            num_rows += 1
+    return num_rows
+
+
+def partition_path(output_path, partition):
+    """ Returns the path of a session partition of the output file, e.g. event_datafile_new_part_003.csv. """
+    name, ext = os.path.splitext(output_path)
+    return '{}_part_{:03d}{}'.format(name, partition, ext)
+
+
+def consolidate_event_files(file_path_list, output_path='event_datafile_new.csv', workers=None, num_partitions=1):
+    """ Consolidates the event files into a single csv file, or into csv files partitioned by sessionId.
+        The files are read and filtered in parallel and written out in order as soon as each one is processed.
+        At most twice as many files as workers are in flight, so the memory usage depends on the number of
+        workers and the file size, not on the number of files.
+
+    Args:
+    file_path_list (list): Paths of the event csv files.
+    output_path (str): The consolidated csv file, or the name pattern of the partitions.
+    workers (int): The number of worker processes, the files are streamed in this process if it is 1.
+    num_partitions (int): The number of output files, rows are assigned by sessionId modulo this number.
+
+    Returns:
+    num_rows (int): The number of rows written.
+    """
+    if num_partitions > 1:
+        paths = [partition_path(output_path, partition) for partition in range(num_partitions)]
+    else:
+        paths = [output_path]
+    outputs = [open(path, 'w', encoding='utf8', newline='') for path in paths]
+    writers = [csv.writer(f, dialect='myDialect') for f in outputs]
+    for writer in writers:
+        writer.writerow(event_columns)
+
+    try:
+        if workers == 1:
+            return write_event_rows(writers, (read_event_rows(filepath) for filepath in file_path_list))
+        workers = workers or multiprocessing.cpu_count()
+        # the files are taken in order, so the output is the same as a sequential run
+        with multiprocessing.Pool(workers) as pool:
+            return write_event_rows(writers, read_event_files_parallel(pool, file_path_list, workers * 2))
+    finally:
+        for f in outputs:
+            f.close()
+
+
+def main(args):
+    """ Consolidates the event data files into the csv file used to load the Apache Cassandra tables.
+
+    Args:
+    args.event_dir (str): The directory of the event data files
+    args.output (str): The consolidated csv file
+    args.workers (int): The number of worker processes
+    args.partitions (int): The number of session partitions of the output
+    """
+    file_path_list = get_event_files(args.event_dir)
+    print('{} event files found in {}'.format(len(file_path_list), args.event_dir))
+    num_rows = consolidate_event_files(file_path_list, args.output, workers=args.workers, num_partitions=args.partitions)
+    if args.partitions > 1:
+        print('{} rows are written to {} session partitions of {}'.format(num_rows, args.partitions, args.output))
+    else:
+        print('{} rows are written to {}'.format(num_rows, args.output))
+
+
+if __name__ == "__main__":
+    # Parse arguments
+    parser = argparse.ArgumentParser(description="Consolidates the Sparkify event data for Apache Cassandra")
+    parser.add_argument("--event-dir", default='event_data', help="Directory of the event data files")
+    parser.add_argument("--output", default='event_datafile_new.csv', help="Consolidated csv file")
+    parser.add_argument("--workers", type=int, default=multiprocessing.cpu_count(), help="Number of worker processes")
+    parser.add_argument("--partitions", type=int, default=1, help="Number of csv files partitioned by sessionId")
+    args = parser.parse_args()
+
+    main(args)
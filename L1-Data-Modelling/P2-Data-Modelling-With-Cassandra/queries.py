@@ -0,0 +1,119 @@
+import argparse
+import itertools
+from decimal import Decimal
+import pandas as pd
+from cassandra.cluster import Cluster, ExecutionProfile
+from cql_queries import *
+
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+# Name of the execution profile whose rows are returned column by column
+columnar_profile = 'columnar'
+
+
+def columnar_factory(colnames, rows):
+    """ Row factory that turns a page of rows into columns, so a page is converted once instead of row by row.
+
+    Args:
+    colnames (list): Names of the columns.
+    rows (list): Rows of the page as tuples.
+
+    Returns:
+    page (dict): The values of each column as a list, keyed on the column names.
+    """
+    columns = list(zip(*rows)) if rows else [()] * len(colnames)
+    return {name: list(values) for name, values in zip(colnames, columns)}
+
+
+def execution_profiles():
+    """ Returns the execution profiles to create the Cluster with, the default profile keeps named tuple rows. """
+    return {columnar_profile: ExecutionProfile(row_factory=columnar_factory)}
+
+
+def prepare_select_queries(session):
+    """ Prepares the SELECT queries of the query tables once.
+
+    Args:
+    session (cassandra Session): The session to execute the queries.
+
+    Returns:
+    prepared (dict): Prepared SELECT queries keyed on the table names.
+    """
+    return {table: session.prepare(query) for table, query in select_queries.items()}
+
+
+def fetch_columns(session, prepared, parameters, fetch_size=5000):
+    """ Runs a prepared query and pages through its results with the columnar execution profile.
+
+    Args:
+    session (cassandra Session): The session to execute the queries.
+    prepared (cassandra PreparedStatement): The prepared query.
+    parameters (tuple): The values of the ? markers.
+    fetch_size (int): The number of rows fetched per page.
+
+    Returns:
+    columns (dict): All values of each column as a list, in the order of the selected columns.
+    """
+    statement = prepared.bind(parameters)
+    statement.fetch_size = fetch_size
+    result = session.execute(statement, execution_profile=columnar_profile)
+    # each page is a single columnar dict, iterating the result fetches the next pages
+    pages = list(result)
+    names = [column[2] for column in prepared.result_metadata]
+    return {name: list(itertools.chain.from_iterable(page[name] for page in pages)) for name in names}
+
+
+def query_frame(session, prepared, parameters, fetch_size=5000):
+    """ Runs a prepared query and returns all its rows as a pandas DataFrame built in one step. """
+    return pd.DataFrame(fetch_columns(session, prepared, parameters, fetch_size))
+
+
+def query_arrow(session, prepared, parameters, fetch_size=5000):
+    """ Runs a prepared query and returns all its rows as an Arrow table built in one step. """
+    if pyarrow is None:
+        raise ImportError('pyarrow is required for Arrow tables, install it with `pip install pyarrow`')
+    return pyarrow.table(fetch_columns(session, prepared, parameters, fetch_size))
+
+
+def parse_value(column, value):
+    """ Converts a value given on the command line to the type of its column. """
+    if column_types[column] in ('int', 'bigint'):
+        return int(value)
+    if column_types[column] == 'decimal':
+        return Decimal(value)
+    return value
+
+
+def main(args):
+    """ Runs the SELECT query of a query table and prints its results.
+
+    Args:
+    args.hosts (list): Contact points of the Apache Cassandra cluster
+    args.table (str): The query table
+    args.values (list): The values of the filter columns of the query
+    args.fetch_size (int): The number of rows fetched per page
+    """
+    cluster = Cluster(args.hosts, execution_profiles=execution_profiles())
+    session = cluster.connect('sparkify_analytics')
+    spec = {spec['table']: spec for spec in query_specs}[args.table]
+    parameters = tuple(parse_value(column, value) for column, value in zip(spec['filter'], args.values))
+    df = query_frame(session, prepare_select_queries(session)[args.table], parameters, args.fetch_size)
+    print(df.to_string())
+    print('{} rows'.format(len(df)))
+    session.shutdown()
+    cluster.shutdown()
+
+
+if __name__ == "__main__":
+    # Parse arguments
+    parser = argparse.ArgumentParser(description="Queries the Sparkify query tables in Apache Cassandra")
+    parser.add_argument("table", choices=[spec['table'] for spec in query_specs], help="Query table")
+    parser.add_argument("values", nargs='+', help="Values of the filter columns, e.g. 338 4 for songs_by_session")
+    parser.add_argument("--hosts", nargs='+', default=['127.0.0.1'], help="Contact points of the Apache Cassandra cluster")
+    parser.add_argument("--fetch-size", type=int, default=5000, help="Number of rows fetched per page")
+    args = parser.parse_args()
+
+    main(args)
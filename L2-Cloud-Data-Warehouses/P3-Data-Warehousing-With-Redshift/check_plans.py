@@ -0,0 +1,105 @@
+import argparse
+import configparser
+import psycopg2
+from local_dwh import connection_string, postgres_dialect
+from sql_queries import plan_check_queries, song_lookup_create, song_lookup_drop, table_design
+
+# Join steps of Redshift query plans that move rows between slices, and what they move
+redistribution_steps = {'DS_BCAST_INNER': 'the inner table is broadcast to all slices',
+                        'DS_DIST_ALL_INNER': 'the inner table is redistributed to a single slice',
+                        'DS_DIST_INNER': 'the inner table is redistributed',
+                        'DS_DIST_OUTER': 'the outer table is redistributed',
+                        'DS_DIST_BOTH': 'both tables are redistributed'}
+
+def explain(cur, query):
+    """ Returns the lines of the query plan of a query.
+
+    Args:
+    cur (psycopg2 cursor)
+    query (str): the query to explain
+
+    Returns:
+    plan (list): lines of the EXPLAIN output
+    """
+    cur.execute('EXPLAIN ' + query)
+    return [row[0] for row in cur.fetchall()]
+
+def find_redistribution(plan):
+    """ Finds the join steps of a query plan that still redistribute or broadcast rows.
+
+    Args:
+    plan (list): lines of the EXPLAIN output
+
+    Returns:
+    findings (list): (step, plan line) pairs
+    """
+    findings = []
+    for line in plan:
+        for step in redistribution_steps:
+            if step in line.split():
+                findings.append((step, line.strip()))
+    return findings
+
+def check_plans(cur, queries, local=False, verbose=False):
+    """ Explains each query and reports the joins that still need redistribution with the current table design.
+
+    Args:
+    cur (psycopg2 cursor)
+    queries (dict): queries to check by name
+    local (bool): Explain the queries in Postgres dialect, whose plans have no distribution steps
+    verbose (bool): Print the whole plan of each query
+
+    Returns:
+    report (dict): findings of each query by name
+    """
+    report = {}
+    for name, query in queries.items():
+        plan = explain(cur, postgres_dialect(query) if local else query)
+        if verbose:
+            print('Plan of \'{}\':\n{}\n'.format(name, '\n'.join(plan)))
+        report[name] = find_redistribution(plan)
+        if report[name]:
+            for step, line in report[name]:
+                print('{}: {} ({})\n    {}'.format(name, step, redistribution_steps[step], line))
+        else:
+            print('{}: no redistribution'.format(name))
+    return report
+
+def main(args):
+    """ Checks the query plans of the ETL and analytics queries against the table design of the selected profile.
+
+    Args:
+    args.local (bool): Explain the queries on the local Postgres stand-in
+    args.verbose (bool): Print the whole plan of each query
+    """
+    # Read the configuration file
+    config = configparser.ConfigParser()
+    config.read('dwh.cfg')
+    print('Table design profile \'{}\':'.format(config.get('TABLE_DESIGN', 'profile', fallback='')))
+    for table, attributes in table_design.items():
+        print('  {}: {}'.format(table, attributes))
+
+    # Connect to the Redshift cluster
+    conn = psycopg2.connect(connection_string(config, args.local))
+    cur = conn.cursor()
+
+    # the songplays insert reads the song lookup, a temporary table of the session
+    for query in [song_lookup_drop, song_lookup_create]:
+        cur.execute(postgres_dialect(query) if args.local else query)
+
+    report = check_plans(cur, plan_check_queries, local=args.local, verbose=args.verbose)
+    num_findings = sum(len(findings) for findings in report.values())
+    print('{} join steps of {} queries need redistribution'.format(num_findings, len(report)))
+
+    # Close the cursor and connection to the database
+    cur.close()
+    conn.close()
+
+if __name__ == "__main__":
+    # Parse arguments
+    parser = argparse.ArgumentParser(description="Reports the joins that redistribute data in the query plans on Redshift")
+    parser.add_argument("--local", help="Explain the queries on the local Postgres stand-in", action="store_true")
+    parser.add_argument("--verbose", help="Print the whole plan of each query", action="store_true")
+    args = parser.parse_args()
+
+    main(args)
\ No newline at end of file
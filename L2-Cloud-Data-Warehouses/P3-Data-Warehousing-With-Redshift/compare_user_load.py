@@ -0,0 +1,118 @@
+import argparse
+import configparser
+import json
+import time
+from datetime import datetime
+import psycopg2
+from local_dwh import connection_string, postgres_dialect
+from sql_queries import user_table_insert, user_table_insert_legacy
+
+# Scaled copy of stage_events, each copy has its own users and sessions.
+# The temporary tables shadow stage_events and users for the queries under comparison.
+scaled_stage_events_create = ("""CREATE TEMP TABLE stage_events AS
+                                 SELECT artist, auth, firstName, gender, itemInSession, lastName, length, level,
+                                        location, method, page, registration, sessionId + n * 1000000 AS sessionId,
+                                        song, status, ts, userAgent, userId + n * 1000000 AS userId
+                                 FROM public.stage_events CROSS JOIN generate_series(0, %s) AS n
+                              """)
+scaled_stage_events_drop = "DROP TABLE IF EXISTS pg_temp.stage_events"
+
+# The users table without its primary key, so that duplicate users are counted instead of failing the insert
+temp_users_create = "CREATE TEMP TABLE users (LIKE public.users)"
+temp_users_drop = "DROP TABLE IF EXISTS pg_temp.users"
+temp_users_truncate = "TRUNCATE pg_temp.users"
+temp_users_select = "SELECT user_id, first_name, last_name, gender, level FROM pg_temp.users"
+
+def run_user_load(cur, query):
+    """ Loads the temporary users table with a query and measures it.
+
+    Args:
+    cur (psycopg2 cursor)
+    query (str): users insert query
+
+    Returns:
+    elapsed (float): run time of the query in seconds
+    rows (list): the loaded users
+    """
+    cur.execute(temp_users_truncate)
+    time_start = time.time()
+    cur.execute(postgres_dialect(query))
+    elapsed = time.time() - time_start
+    cur.execute(temp_users_select)
+    return elapsed, cur.fetchall()
+
+def compare_user_load(cur, scale):
+    """ Runs the legacy and the window-function users loads on stage_events scaled by the given factor and compares them.
+
+    Args:
+    cur (psycopg2 cursor)
+    scale (int): number of copies of stage_events
+
+    Returns:
+    result (dict): stage rows, run times, user counts and the differences of the two loads
+    """
+    cur.execute(scaled_stage_events_drop)
+    cur.execute(scaled_stage_events_create, (scale - 1,))
+    cur.execute("SELECT COUNT(*) FROM pg_temp.stage_events")
+    stage_rows = cur.fetchone()[0]
+    cur.execute(temp_users_drop)
+    cur.execute(temp_users_create)
+
+    legacy_time, legacy_rows = run_user_load(cur, user_table_insert_legacy)
+    rewrite_time, rewrite_rows = run_user_load(cur, user_table_insert)
+    legacy_ids = [row[0] for row in legacy_rows]
+    return {'scale': scale,
+            'stage_rows': stage_rows,
+            'legacy_seconds': legacy_time,
+            'rewrite_seconds': rewrite_time,
+            'legacy_users': len(legacy_rows),
+            'rewrite_users': len(rewrite_rows),
+            # the legacy load inserts a user more than once when the latest ts has several events
+            'legacy_duplicate_users': len(legacy_ids) - len(set(legacy_ids)),
+            'only_legacy': len(set(legacy_rows) - set(rewrite_rows)),
+            'only_rewrite': len(set(rewrite_rows) - set(legacy_rows)),
+            'match': set(legacy_rows) == set(rewrite_rows)}
+
+def main(args):
+    """ Compares the results and the run times of the legacy and the window-function users loads on the local Postgres stand-in.
+    The staging tables must be loaded first with 'python etl.py --local'.
+
+    Args:
+    args.scales (list): Sizes of stage_events as multiples of the loaded one
+    args.output (str): JSON file to save the results
+    """
+    # Read the configuration file
+    config = configparser.ConfigParser()
+    config.read('dwh.cfg')
+
+    # Connect to the local Postgres stand-in, the temporary tables are dropped with the session
+    conn = psycopg2.connect(connection_string(config, local=True))
+    cur = conn.cursor()
+
+    results = []
+    for scale in args.scales:
+        result = compare_user_load(cur, scale)
+        results.append(result)
+        print('x{:<5} {:>9} stage rows  legacy {:8.3f}s  rewrite {:8.3f}s  users {} / {}  duplicates {}  {}'.format(
+              scale, result['stage_rows'], result['legacy_seconds'], result['rewrite_seconds'],
+              result['legacy_users'], result['rewrite_users'], result['legacy_duplicate_users'],
+              'match' if result['match'] else 'MISMATCH ({} only legacy, {} only rewrite)'.format(
+                  result['only_legacy'], result['only_rewrite'])))
+    conn.rollback()
+
+    with open(args.output, 'w') as f:
+        json.dump({'timestamp': datetime.now().isoformat(), 'results': results}, f, indent=2)
+    print('Results are saved to {}'.format(args.output))
+
+    # Close the cursor and connection to the database
+    cur.close()
+    conn.close()
+
+if __name__ == "__main__":
+    # Parse arguments
+    parser = argparse.ArgumentParser(description="Compares the legacy and the window-function users loads on a local Postgres")
+    parser.add_argument("--scales", type=int, nargs='+', default=[1, 10, 100], help="Sizes of stage_events as multiples of the loaded one")
+    parser.add_argument("--output", default='user_load_comparison.json', help="JSON file to save the results")
+    args = parser.parse_args()
+
+    main(args)
\ No newline at end of file
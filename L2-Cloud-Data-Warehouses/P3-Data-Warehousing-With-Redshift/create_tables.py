@@ -1,5 +1,7 @@
+import argparse
 import configparser
 import psycopg2
+from local_dwh import connection_string, postgres_dialect
 from sql_queries import create_table_queries, drop_table_queries
 
 def drop_tables(cur, conn):
@@ -8,18 +10,21 @@ def drop_tables(cur, conn):
         cur.execute(query)
         conn.commit()
 
-def create_tables(cur, conn):
-    """ Creates each table using the queries in 'create_table_queries' list. """
+def create_tables(cur, conn, local=False):
+    """ Creates each table using the queries in 'create_table_queries' list, in Postgres dialect if local is set. """
     for query in create_table_queries:
-        cur.execute(query)
+        cur.execute(postgres_dialect(query) if local else query)
         conn.commit()
 
-def main():
+def main(args):
     """ 
     - Reads the configuration file.
     - Connects to the Redshift cluster through its endpoint address.
     - Drops the staging tables and fact/dimenion tables if exists.
     - Creates new staging tables and fact/dimenion tables.
+
+    Args:
+    args.local (bool): Create the tables in the local Postgres stand-in of the [LOCAL] section
     """
 
     # Read the configuration file
@@ -27,16 +32,21 @@ def main():
     config.read('dwh.cfg')
 
     # Connect to the Redshift cluster
-    conn = psycopg2.connect("host={} dbname={} user={} password={} port={}".format(*config['CLUSTER'].values()))
+    conn = psycopg2.connect(connection_string(config, args.local))
     cur = conn.cursor()
 
     # Drop the tables if exists and then create new tables
     drop_tables(cur, conn)
-    create_tables(cur, conn)
+    create_tables(cur, conn, local=args.local)
 
     # Close the cursor and connection to the database
     cur.close()
     conn.close()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    # Parse arguments
+    parser = argparse.ArgumentParser(description="Creates the Sparkify tables on Redshift")
+    parser.add_argument("--local", help="Create the tables in the local Postgres stand-in", action="store_true")
+    args = parser.parse_args()
+
+    main(args)
\ No newline at end of file
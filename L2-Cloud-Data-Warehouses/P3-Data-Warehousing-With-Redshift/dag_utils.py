@@ -0,0 +1,47 @@
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+def run_dag(steps, dependencies, run_step, max_workers=None, progress=None):
+    """ Runs steps in a thread pool as soon as the steps they depend on are completed.
+
+    Args:
+    steps (list): names of the steps
+    dependencies (dict): names of the steps each step depends on
+    run_step (function): runs a step given its name and the results of its dependencies by name
+    max_workers (int): maximum number of steps running at the same time, all steps if None
+    progress (function): handler of the 'started', 'completed' and 'failed' events of the steps,
+                         called with the name of the step, the event and the seconds since the start
+
+    Returns:
+    results (dict): results of the steps by name
+
+    Raises:
+    ValueError: if the dependencies have a cycle or refer to an unknown step
+    """
+    results = {}
+    remaining = list(steps)
+    running = {}
+    time_start = time.time()
+    with ThreadPoolExecutor(max_workers=max_workers or len(remaining) or 1) as executor:
+        while remaining or running:
+            for name in [name for name in remaining if set(dependencies.get(name, [])) <= set(results)]:
+                remaining.remove(name)
+                if progress is not None:
+                    progress(name, 'started', time.time() - time_start)
+                inputs = {dependency: results[dependency] for dependency in dependencies.get(name, [])}
+                running[executor.submit(run_step, name, inputs)] = name
+            if not running:
+                raise ValueError('Steps {} have unmet or cyclic dependencies'.format(remaining))
+            completed, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in completed:
+                name = running.pop(future)
+                try:
+                    results[name] = future.result()
+                except Exception:
+                    # re-raise the error of a failed step, the steps already running are finished first
+                    if progress is not None:
+                        progress(name, 'failed', time.time() - time_start)
+                    raise
+                if progress is not None:
+                    progress(name, 'completed', time.time() - time_start)
+    return results
\ No newline at end of file
@@ -1,33 +1,315 @@
+import argparse
 import configparser
+import heapq
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
 import psycopg2
-from sql_queries import copy_table_queries, insert_table_queries
+import psycopg2.pool
+from dag_utils import run_dag
+from instrumentation import fetch_query_details, record_statement, run_query, write_run_report
+from local_dwh import connection_string, copy_local_json, list_local_files, postgres_dialect
+from s3_utils import create_s3_client, list_s3_files
+from sql_queries import *
 
-def load_staging_tables(cur, conn):
-    """ Load songs and users log data from S3 into Redshift staging tables. """
-    
-    print('Copying songs and users log data from S3 to Redshift staging tables')
-    for query in copy_table_queries:
-        print('Executing the following query:\n{}'.format(query))
-        cur.execute(query)
+# Staging tables with their COPY queries and the [S3] / [LOCAL] config key of their data
+staging_tables = [{'table': 'stage_events', 'copy': staging_events_copy,
+                   'manifest_copy': staging_events_manifest_copy, 'data': 'log_data'},
+                  {'table': 'stage_songs', 'copy': staging_songs_copy,
+                   'manifest_copy': staging_songs_manifest_copy, 'data': 'song_data'}]
+
+def get_num_slices(cur, conn):
+    """ Returns the number of slices of the cluster, 1 for the local Postgres stand-in without stv_slices. """
+    try:
+        cur.execute(num_slices_select)
+        return cur.fetchone()[0]
+    except psycopg2.Error:
+        conn.rollback()
+        return 1
+
+def get_num_nodes(cur):
+    """ Returns the number of compute nodes of the cluster. """
+    cur.execute(num_nodes_select)
+    return cur.fetchone()[0]
+
+def split_file_groups(files, num_slices, files_per_slice):
+    """ Splits the data files into groups of at most num_slices * files_per_slice files with similar total sizes.
+    The largest files are placed first, each into the group with the fewest bytes that is not full yet,
+    so every COPY keeps all slices busy with about the same amount of data.
+
+    Args:
+    files (list): (path or url, size in bytes) pairs
+    num_slices (int): number of slices of the cluster
+    files_per_slice (int): number of files per slice in a group
+
+    Returns:
+    groups (list): lists of paths or urls
+    """
+    group_size = num_slices * files_per_slice
+    num_groups = max(1, -(-len(files) // group_size))
+    heap = [(0, i, []) for i in range(num_groups)]
+    full = []
+    for path, size in sorted(files, key=lambda f: f[1], reverse=True):
+        total, i, group = heapq.heappop(heap)
+        group.append(path)
+        if len(group) < group_size:
+            heapq.heappush(heap, (total + size, i, group))
+        else:
+            full.append((i, group))
+    full += [(i, group) for total, i, group in heap]
+    return [group for i, group in sorted(full) if group]
+
+def write_manifest(s3_client, manifest_url, urls):
+    """ Writes a COPY manifest listing the given files to S3. """
+    bucket, key = manifest_url.replace('s3://', '').split('/', 1)
+    manifest = {'entries': [{'url': url, 'mandatory': True} for url in urls]}
+    s3_client.put_object(Bucket=bucket, Key=key, Body=json.dumps(manifest).encode())
+
+def create_manifests(config, table, groups):
+    """ Writes a COPY manifest to the manifest prefix for each file group of a staging table.
+
+    Returns:
+    manifest_urls (list): S3 urls of the manifests
+    """
+    s3_client = create_s3_client(config)
+    manifest_prefix = config.get('S3', 'manifest_prefix').rstrip('/')
+    manifest_urls = []
+    for i, urls in enumerate(groups):
+        manifest_url = '{}/{}_{:04d}.manifest'.format(manifest_prefix, table, i)
+        write_manifest(s3_client, manifest_url, urls)
+        manifest_urls.append(manifest_url)
+    print('{} COPY manifests are written to {} for {}'.format(len(manifest_urls), manifest_prefix, table))
+    return manifest_urls
+
+def copy_local_files(cur, table, filepaths, records):
+    """ Loads local JSON files into a staging table of the local Postgres stand-in and records the load like a COPY. """
+    time_start = time.time()
+    num_rows = copy_local_json(cur, table, filepaths)
+    record_statement(records, table, 'COPY {} FROM STDIN'.format(table), time_start, time.time() - time_start, num_rows)
+
+def copy_staging_table(config, staging, local=False, manifest=False, files_per_slice=10000, records=None, list_files=False):
+    """ Loads a staging table on its own connection, so that the staging tables are loaded at the same time.
+
+    Args:
+    config: configuration for AWS/S3/Redshift cluster/IAM role
+    staging (dict): staging table from 'staging_tables' list
+    local (bool): Load local JSON files into the local Postgres stand-in
+    manifest (bool): Split the data files into groups sized to the slice count and COPY each group with a manifest
+    files_per_slice (int): number of files per slice in a group
+    records (list): records of the statements of the run
+    list_files (bool): List the S3 files without a manifest too, for the number of files and bytes of the load history
+
+    Returns:
+    load (dict): table, number of files and bytes (None if the S3 files are not listed) and load time in seconds
+    """
+    if records is None:
+        records = []
+    table = staging['table']
+    # a plain COPY reads the S3 prefix itself, the files are only listed for the manifests or the load history
+    files = None
+    if local:
+        files = list_local_files(config.get('LOCAL', staging['data']))
+    elif manifest or list_files:
+        files = list_s3_files(create_s3_client(config), config.get('S3', staging['data']))
+    # the listing is not part of the load time used by manage_dwh.py plan
+    time_start = time.time()
+    conn = psycopg2.connect(connection_string(config, local))
+    cur = conn.cursor()
+    if manifest:
+        num_slices = get_num_slices(cur, conn)
+        groups = split_file_groups(files, num_slices, files_per_slice)
+        print('{}: {} files are split into {} groups for {} slices'.format(table, len(files), len(groups), num_slices))
+        if local:
+            for group in groups:
+                copy_local_files(cur, table, group, records)
+                conn.commit()
+        else:
+            for manifest_url in create_manifests(config, table, groups):
+                run_query(cur, staging['manifest_copy'].format(manifest_url), table, records)
+                conn.commit()
+    elif local:
+        copy_local_files(cur, table, [path for path, size in files], records)
+        conn.commit()
+    else:
+        record = run_query(cur, staging['copy'], table, records)
+        print('{}: {} rows copied by query {}'.format(table, record['rows'], record['query_id']))
         conn.commit()
-        print('The execution of the query is completed\n')
+    cur.close()
+    conn.close()
+    elapsed = time.time() - time_start
+    print('{} is loaded in {:.1f} seconds'.format(table, elapsed))
+    return {'table': table,
+            'files': None if files is None else len(files),
+            'bytes': None if files is None else sum(size for path, size in files),
+            'seconds': elapsed}
+
+def load_staging_tables(config, local=False, manifest=False, files_per_slice=10000, records=None, list_files=False):
+    """ Load songs and users log data from S3 into Redshift staging tables, each on its own connection at the same time.
 
-def insert_tables(cur, conn):
+    Returns:
+    loads (list): table, number of files, bytes and load time of each staging table
+    seconds (float): load time of all staging tables
+    """
+
+    print('Copying songs and users log data from S3 to Redshift staging tables')
+    time_start = time.time()
+    with ThreadPoolExecutor(max_workers=len(staging_tables)) as executor:
+        futures = [executor.submit(copy_staging_table, config, staging, local, manifest, files_per_slice, records, list_files)
+                   for staging in staging_tables]
+        loads = [future.result() for future in futures]
+    elapsed = time.time() - time_start
+    print('Staging tables are loaded in {:.1f} seconds\n'.format(elapsed))
+    return loads, elapsed
+
+def record_load_history(cur, conn, loads, history_file='load_history.json'):
+    """ Appends the size and the time of a staging load on Redshift to the load history file,
+    with the number of nodes and slices of the cluster that ran it.
+
+    Args:
+    cur: cursor object of the cluster
+    conn: connection object of the cluster
+    loads (list): table, number of files, bytes and load time of each staging table
+    history_file (str): JSON file of the load history
+    """
+    try:
+        with open(history_file) as f:
+            history = json.load(f)
+    except FileNotFoundError:
+        history = []
+    history.append({'timestamp': datetime.now().isoformat(),
+                    'num_nodes': get_num_nodes(cur),
+                    'num_slices': get_num_slices(cur, conn),
+                    'files': sum(load['files'] for load in loads),
+                    'bytes': sum(load['bytes'] for load in loads),
+                    # the staging tables are loaded at the same time
+                    'seconds': max(load['seconds'] for load in loads),
+                    'tables': loads})
+    with open(history_file, 'w') as f:
+        json.dump(history, f, indent=2)
+    print('The load is recorded in {}'.format(history_file))
+
+def insert_tables(cur, conn, local=False, records=None):
     """ Load songs and users log data from S3 into Redshift staging tables. """
-    
+
+    if records is None:
+        records = []
     print('Creating star schema by inserting data from staging tables')
-    for query in insert_table_queries:
-        print('Executing the following query:\n{}'.format(query))
+    # the steps hold the queries of insert_table_queries in the same order, keyed on their table
+    for table, queries in insert_table_steps.items():
+        for query in (queries if isinstance(queries, list) else [queries]):
+            record = run_query(cur, query, table, records, local)
+            conn.commit()
+            print('{}: {} rows in {:.1f} seconds: {}'.format(table, record['rows'], record['seconds'], record['query'][:80]))
+
+def report_songplay_fanout(cur, conn, local=False):
+    """ Reports how many rows the songplays join produces per matched event,
+    with the previous joins on title and artist name and with the song lookup keyed on (title, artist_name, duration).
+    """
+    queries = [song_lookup_drop, song_lookup_create]
+    for query in queries:
+        cur.execute(postgres_dialect(query) if local else query)
+    for name, query in [('title & name joins', songplay_fanout_legacy_select), ('song lookup', songplay_fanout_select)]:
+        cur.execute(postgres_dialect(query) if local else query)
+        num_events, num_rows, max_rows = cur.fetchone()
+        print('Songplays join with {}: {} events matched, {} rows, {:.2f} rows per event on average, {} at most'.format(
+              name, num_events, num_rows or 0, (num_rows or 0) / num_events if num_events else 0, max_rows or 0))
+    cur.execute(song_lookup_drop)
+    conn.commit()
+
+def truncate_staging_tables(cur, conn):
+    """ Empties the staging tables before an incremental load. """
+    for query in staging_tables_truncate:
         cur.execute(query)
+    conn.commit()
+
+def merge_tables(cur, conn, local=False, records=None):
+    """ Merges the staging rows after the watermark into fact/dimension tables in a single transaction.
+    The dimensions are updated and inserted on their keys and the new songplays are appended,
+    so the load time depends on the new data and not on the size of the existing tables.
+    Staged events at or before the watermark arrived late and are skipped, their number is reported.
+    """
+
+    if records is None:
+        records = []
+    cur.execute(watermark_select)
+    print('Merging staging rows after the watermark ts={} into fact and dimension tables'.format(cur.fetchone()[0]))
+    # late events are not merged, they are reported so that the missing songplays, users and start times are visible
+    cur.execute(late_events_select)
+    num_late, num_late_songplays = cur.fetchone()
+    if num_late:
+        print('WARNING: {} staged events ({} song plays) are at or before the watermark and are skipped'.format(
+              num_late, num_late_songplays))
+    time_start = time.time()
+    try:
+        for step, queries in merge_table_steps.items():
+            for query in queries:
+                record = run_query(cur, query, 'merge ' + step, records, local)
+                print('{}: {} rows in {:.1f} seconds: {}'.format(step, record['rows'], record['seconds'], record['query'][:80]))
         conn.commit()
-        print('The execution of the query is completed\n')
+    except Exception:
+        conn.rollback()
+        raise
+    cur.execute(watermark_select)
+    print('Merge is completed in {:.1f} seconds, the watermark is now ts={}\n'.format(time.time() - time_start, cur.fetchone()[0]))
+
+def insert_tables_parallel(config, local=False, max_workers=4, records=None):
+    """ Inserts data from staging tables into fact/dimension tables, independent tables at the same time on pooled connections. """
+
+    if records is None:
+        records = []
+    print('Creating star schema by inserting data from staging tables with up to {} connections'.format(max_workers))
+    dependencies = dict(insert_table_dependencies)
+    if local:
+        # Postgres enforces the foreign keys of songplays, Redshift only uses them for query planning
+        dependencies['songplays'] = dependencies['songplays'] + ['users', 'time']
+    pool = psycopg2.pool.ThreadedConnectionPool(1, max_workers, connection_string(config, local))
 
-def main():
-    """ 
+    def run_insert(table, inputs):
+        # a step is a query or a list of queries that must run on the same connection
+        queries = insert_table_steps[table]
+        if isinstance(queries, str):
+            queries = [queries]
+        conn = pool.getconn()
+        try:
+            time_start = time.time()
+            num_rows = 0
+            with conn.cursor() as cur:
+                for query in queries:
+                    record = run_query(cur, query, table, records, local)
+                    if query.lstrip().startswith('INSERT'):
+                        num_rows += record['rows']
+            conn.commit()
+            print('{}: {} rows inserted in {:.1f} seconds'.format(table, num_rows, time.time() - time_start))
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            pool.putconn(conn)
+
+    time_start = time.time()
+    try:
+        run_dag(list(insert_table_steps), dependencies, run_insert, max_workers)
+    finally:
+        pool.closeall()
+    print('Fact and dimension tables are loaded in {:.1f} seconds\n'.format(time.time() - time_start))
+
+def main(args):
+    """
     - Reads the configuration file.
     - Connects to the Redshift cluster through its endpoint address.
     - Loads data from S3 into staging tables.
     - Performs ETL on staging tables and inserts data into fact/dimention tables.
+
+    Args:
+    args.local (bool): Run against the local Postgres stand-in and local JSON files in the [LOCAL] section
+    args.manifest (bool): COPY the staging tables from manifests of file groups sized to the slice count
+    args.files_per_slice (int): Number of files per slice in a manifest file group
+    args.insert_workers (int): Number of connections inserting into fact/dimension tables at the same time, 1 to insert one by one
+    args.incremental (bool): Merge only the events after the watermark into the existing fact/dimension tables
+    args.fanout_report (bool): Report the rows per event of the songplays join with and without the song lookup
+    args.history (str): JSON file to append the size and the time of the staging load to
+    args.report_dir (str): Directory of the JSON reports of the statements of each run
     """
 
     # Read the configuration file
@@ -35,16 +317,68 @@ def main():
     config.read('dwh.cfg')
 
     # Connect to the Redshift cluster
-    conn = psycopg2.connect("host={} dbname={} user={} password={} port={}".format(*config['CLUSTER'].values()))
+    conn = psycopg2.connect(connection_string(config, args.local))
     cur = conn.cursor()
 
-    # Load data from S3 into staging tables and perform ETL in Redshift
-    load_staging_tables(cur, conn)
-    insert_tables(cur, conn)
+    # Wall time, rows and query id of each statement of the run, reported at the end even if a statement fails
+    records = []
+    run_start = datetime.now(timezone.utc)
+    status = 'failed'
+    try:
+        # The staging tables of an incremental load hold only the new files
+        if args.incremental:
+            truncate_staging_tables(cur, conn)
+
+        # Load data from S3 into staging tables, each table on its own connection
+        loads, seconds = load_staging_tables(config, local=args.local, manifest=args.manifest, files_per_slice=args.files_per_slice,
+                                             records=records, list_files=bool(args.history))
+        # The local stand-in says nothing about the load time on Redshift
+        if args.history and args.local:
+            print('The load on the local Postgres stand-in is not recorded in {}'.format(args.history))
+        elif args.history:
+            record_load_history(cur, conn, loads, history_file=args.history)
+
+        # Perform ETL in Redshift
+        if args.incremental:
+            merge_tables(cur, conn, local=args.local, records=records)
+        elif args.insert_workers > 1:
+            # the independent tables at the same time on pooled connections
+            insert_tables_parallel(config, local=args.local, max_workers=args.insert_workers, records=records)
+        else:
+            insert_tables(cur, conn, local=args.local, records=records)
+
+        if args.fanout_report:
+            report_songplay_fanout(cur, conn, local=args.local)
+        status = 'completed'
+    finally:
+        # Add the query steps and the rejected rows from the system tables of Redshift
+        # A failure to fetch them must not hide the error of the run, the report is written without them
+        seconds = (datetime.now(timezone.utc) - run_start).total_seconds()
+        load_errors = []
+        if conn.closed:
+            print('The connection is closed, the query steps and load errors are not fetched')
+        else:
+            try:
+                load_errors = fetch_query_details(cur, conn, records, run_start, local=args.local)
+            except psycopg2.Error as e:
+                print('The query steps and load errors could not be fetched: {}'.format(e))
+        write_run_report(records, load_errors, run_start, seconds, status, local=args.local, report_dir=args.report_dir)
 
     # Close the cursor and connection to the database
     cur.close()
     conn.close()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    # Parse arguments
+    parser = argparse.ArgumentParser(description="Sparkify ETL on Redshift")
+    parser.add_argument("--local", help="Run against the local Postgres stand-in with local JSON files", action="store_true")
+    parser.add_argument("--manifest", help="COPY staging tables from manifests of file groups sized to the slice count", action="store_true")
+    parser.add_argument("--files-per-slice", type=int, default=10000, help="Number of files per slice in a manifest file group")
+    parser.add_argument("--insert-workers", type=int, default=4, help="Number of connections inserting into fact/dimension tables at the same time")
+    parser.add_argument("--incremental", help="Merge only the new staging rows into the existing fact/dimension tables", action="store_true")
+    parser.add_argument("--fanout-report", help="Report the rows per event of the songplays join with and without the song lookup", action="store_true")
+    parser.add_argument("--history", help="JSON file to append the size and the time of the staging load to, e.g. load_history.json")
+    parser.add_argument("--report-dir", default='etl_reports', help="Directory of the JSON reports of the statements of each run")
+    args = parser.parse_args()
+
+    main(args)
\ No newline at end of file
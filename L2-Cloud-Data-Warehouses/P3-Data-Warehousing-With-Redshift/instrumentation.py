@@ -0,0 +1,137 @@
+import json
+import os
+import time
+from datetime import datetime, timezone
+from local_dwh import postgres_dialect
+from sql_queries import last_copy_count_select, last_query_id_select, load_errors_select, query_summary_select
+
+def record_statement(records, step, query, time_start, seconds, rows, query_id=None, error=None):
+    """ Appends the measurements of a statement to the records of the run.
+
+    Args:
+    records (list): records of the statements of the run, shared by the threads of the run
+    step (str): name of the ETL step such as the table it loads
+    query (str): the statement
+    time_start (float): start time of the statement from time.time()
+    seconds (float): wall time of the statement
+    rows (int): rows affected, None if unknown
+    query_id (int): Redshift query id, None on the local Postgres stand-in
+    error (str): error of a failed statement
+
+    Returns:
+    record (dict): the appended record
+    """
+    record = {'step': step,
+              'query': ' '.join(query.split()),
+              'started_at': datetime.fromtimestamp(time_start, timezone.utc).isoformat(),
+              'seconds': seconds,
+              'rows': rows,
+              'query_id': query_id,
+              'error': error}
+    records.append(record)
+    return record
+
+def run_query(cur, query, step, records, local=False):
+    """ Executes a statement and records its wall time, rows affected and Redshift query id.
+
+    Args:
+    cur (psycopg2 cursor)
+    query (str): the statement in Redshift dialect
+    step (str): name of the ETL step such as the table it loads
+    records (list): records of the statements of the run
+    local (bool): Run the statement in Postgres dialect, the local stand-in has no query ids
+
+    Returns:
+    record (dict): the measurements of the statement
+    """
+    time_start = time.time()
+    try:
+        cur.execute(postgres_dialect(query) if local else query)
+    except Exception as e:
+        record_statement(records, step, query, time_start, time.time() - time_start, None, error=str(e).strip())
+        raise
+    seconds = time.time() - time_start
+    rows = cur.rowcount if cur.rowcount >= 0 else None
+    query_id = None
+    if not local:
+        if query.lstrip().upper().startswith('COPY'):
+            cur.execute(last_copy_count_select)
+            rows = cur.fetchone()[0]
+        cur.execute(last_query_id_select)
+        query_id = cur.fetchone()[0]
+    return record_statement(records, step, query, time_start, seconds, rows, query_id)
+
+def fetch_query_details(cur, conn, records, run_start, local=False):
+    """ Adds the steps of each recorded query from SVL_QUERY_SUMMARY and the rejected rows from STL_LOAD_ERRORS.
+    Nothing is added on the local Postgres stand-in, which has no system tables.
+
+    Args:
+    cur (psycopg2 cursor)
+    conn (psycopg2 connection)
+    records (list): records of the statements of the run
+    run_start (datetime): UTC start time of the run
+    local (bool): The run is on the local Postgres stand-in
+
+    Returns:
+    load_errors (list): rejected rows of the COPYs of the run
+    """
+    if local:
+        return []
+    conn.rollback()
+    # starttime of STL_LOAD_ERRORS is a UTC timestamp without time zone
+    cur.execute(load_errors_select, (run_start.replace(tzinfo=None),))
+    load_errors = [{'query_id': query_id, 'filename': filename, 'line_number': line_number, 'column': colname,
+                    'type': column_type, 'raw_value': raw_value, 'err_code': err_code, 'err_reason': err_reason}
+                   for query_id, filename, line_number, colname, column_type, raw_value, err_code, err_reason in cur.fetchall()]
+    by_query = {record['query_id']: record for record in records if record['query_id'] is not None}
+    for record in by_query.values():
+        record['load_errors'] = [error for error in load_errors if error['query_id'] == record['query_id']]
+        record['summary'] = []
+    if by_query:
+        cur.execute(query_summary_select, (tuple(by_query),))
+        for query_id, stm, seg, step, label, rows, num_bytes, maxtime, is_diskbased in cur.fetchall():
+            by_query[query_id]['summary'].append({'stm': stm, 'seg': seg, 'step': step, 'label': label,
+                                                  'rows': rows, 'bytes': num_bytes, 'maxtime': maxtime,
+                                                  'is_diskbased': is_diskbased.strip() == 't'})
+    conn.rollback()
+    return load_errors
+
+def write_run_report(records, load_errors, run_start, seconds, status, local=False, report_dir='etl_reports', num_slowest=5):
+    """ Writes the records of a run to a JSON report and prints its slowest statements.
+
+    Args:
+    records (list): records of the statements of the run
+    load_errors (list): rejected rows of the COPYs of the run
+    run_start (datetime): UTC start time of the run
+    seconds (float): wall time of the run
+    status (str): 'completed' or 'failed'
+    local (bool): The run is on the local Postgres stand-in
+    report_dir (str): directory of the reports, one file per run
+    num_slowest (int): number of the slowest statements to print
+
+    Returns:
+    report_path (str): path of the report
+    """
+    os.makedirs(report_dir, exist_ok=True)
+    report_path = os.path.join(report_dir, 'etl_run_{}.json'.format(run_start.strftime('%Y%m%d_%H%M%S')))
+    steps = {}
+    for record in records:
+        steps[record['step']] = steps.get(record['step'], 0) + record['seconds']
+    report = {'run_start': run_start.isoformat(),
+              'local': local,
+              'status': status,
+              'seconds': seconds,
+              'steps': steps,
+              'statements': records,
+              'load_errors': load_errors}
+    with open(report_path, 'w') as f:
+        json.dump(report, f, indent=2, default=str)
+
+    print('Slowest statements of the run:')
+    for record in sorted(records, key=lambda r: r['seconds'], reverse=True)[:num_slowest]:
+        print('  {:8.1f}s {:>10} rows  {:<12} {}'.format(record['seconds'], record['rows'] if record['rows'] is not None else '-',
+                                                         record['step'], record['query'][:60]))
+    if load_errors:
+        print('WARNING: {} rows were rejected by COPY, see STL_LOAD_ERRORS in the report'.format(len(load_errors)))
+    print('The run report is saved to {}'.format(report_path))
+    return report_path
\ No newline at end of file
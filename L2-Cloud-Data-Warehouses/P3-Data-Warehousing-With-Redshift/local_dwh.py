@@ -0,0 +1,75 @@
+import csv
+import glob
+import io
+import json
+import os
+import re
+
+# Redshift-only syntax used by the queries and its Postgres equivalent
+postgres_replacements = [(r'bigint identity\(0, 1\)', 'bigserial'),
+                         (r'EXTRACT\(dayofweek from', 'EXTRACT(dow from'),
+                         (r'getdate\(\)', 'now()'),
+                         (r'\s*(DISTSTYLE \w+|DISTKEY\(\w+\)|((COMPOUND|INTERLEAVED) )?SORTKEY\([^)]*\))', '')]
+
+def connection_string(config, local=False):
+    """ Returns the connection string of the Redshift cluster or of the local Postgres stand-in.
+
+    Args:
+    config: configuration for AWS/S3/Redshift cluster/IAM role
+    local (bool): Use the [LOCAL] section instead of the [CLUSTER] section
+
+    Returns:
+    conn_string (str): connection string for psycopg2
+    """
+    if not local:
+        return "host={} dbname={} user={} password={} port={}".format(*config['CLUSTER'].values())
+    return "host={} dbname={} user={} password={} port={}".format(*[config.get('LOCAL', key) for key in
+                                                                     ('host', 'db_name', 'db_user', 'db_password', 'db_port')])
+
+def postgres_dialect(query):
+    """ Rewrites the Redshift-only syntax of a query so that it runs on Postgres. """
+    for pattern, replacement in postgres_replacements:
+        query = re.sub(pattern, replacement, query)
+    return query
+
+def list_local_files(data_dir):
+    """ Lists the JSON files under a local directory with their sizes, like an S3 prefix listing.
+
+    Args:
+    data_dir (str): local directory of the data files
+
+    Returns:
+    files (list): (path, size in bytes) pairs sorted by path
+    """
+    paths = sorted(glob.glob(os.path.join(data_dir, '**', '*.json'), recursive=True))
+    return [(path, os.path.getsize(path)) for path in paths]
+
+def copy_local_json(cur, table, filepaths):
+    """ Stand-in for Redshift COPY from S3: loads local JSON files into a staging table with COPY FROM STDIN.
+    The JSON keys are matched to the columns by name, case-insensitively as Redshift does with json 'auto'.
+
+    Args:
+    cur (psycopg2 cursor): cursor of the local Postgres database
+    table (str): staging table name
+    filepaths (list): paths of the JSON files, each with one or more records
+
+    Returns:
+    num_rows (int): number of rows copied
+    """
+    cur.execute("SELECT * FROM {} LIMIT 0".format(table))
+    columns = [column[0] for column in cur.description]
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    num_rows = 0
+    for filepath in filepaths:
+        with open(filepath) as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                record = {key.lower(): value for key, value in json.loads(line).items()}
+                # empty strings and missing keys are loaded as NULL like Redshift does for numeric columns
+                writer.writerow(['' if record.get(column) is None else record[column] for column in columns])
+                num_rows += 1
+    buffer.seek(0)
+    cur.copy_expert("COPY {} ({}) FROM STDIN WITH CSV".format(table, ', '.join(columns)), buffer)
+    return num_rows
\ No newline at end of file
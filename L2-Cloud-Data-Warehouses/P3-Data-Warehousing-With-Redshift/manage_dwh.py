@@ -1,30 +1,105 @@
 import argparse
+import collections
 import configparser
 import json
+import random
 import time
 import boto3
+from dag_utils import run_dag
+from s3_utils import create_s3_client, list_s3_files
 
-def create_clients(access_key_id, secret_access_key, region_name):
+# Slices per node, allowed number of nodes and approximate on-demand price per node hour (USD, us-west-2) of Redshift node types
+node_types = {'dc2.large': {'slices': 2, 'min_nodes': 1, 'max_nodes': 32, 'price': 0.25},
+              'dc2.8xlarge': {'slices': 16, 'min_nodes': 2, 'max_nodes': 128, 'price': 4.80},
+              'ra3.xlplus': {'slices': 2, 'min_nodes': 1, 'max_nodes': 32, 'price': 1.086},
+              'ra3.4xlarge': {'slices': 4, 'min_nodes': 2, 'max_nodes': 64, 'price': 3.26},
+              'ra3.16xlarge': {'slices': 16, 'min_nodes': 2, 'max_nodes': 128, 'price': 13.04}}
+
+# Load cost of a file in bytes on top of its size, COPY opens each file on a slice and small files are slow to load
+file_overhead_bytes = 1024 * 1024
+# Bytes loaded per second by a slice when there is no load history yet
+default_slice_throughput = 2 * 1024 * 1024
+
+def create_clients(access_key_id, secret_access_key, region_name, endpoint_url=None):
     """ Creates boto3 resource for EC2 and clients for IAM and Redshift.
     
     Args:
     access_key_id (str): AWS access key id
     secret_access_key (str): AWS secret access key
     region_name (str): AWS region name
+    endpoint_url (str): endpoint of a local AWS stand-in such as moto server, None for AWS
     
     Returns:
     ec2_resource: boto3 resource for EC2
     iam_client: boto3 client for IAM
     redshift_client: boto3 client for Redshift
     """
-    ec2_resource = boto3.resource('ec2', region_name = region_name,
+    ec2_resource = boto3.resource('ec2', region_name = region_name, endpoint_url=endpoint_url,
                          aws_access_key_id=access_key_id, aws_secret_access_key=secret_access_key)
-    iam_client = boto3.client('iam', region_name = region_name,
+    iam_client = boto3.client('iam', region_name = region_name, endpoint_url=endpoint_url,
                        aws_access_key_id=access_key_id, aws_secret_access_key=secret_access_key)
-    redshift_client = boto3.client('redshift', region_name = region_name,
+    redshift_client = boto3.client('redshift', region_name = region_name, endpoint_url=endpoint_url,
                             aws_access_key_id=access_key_id, aws_secret_access_key=secret_access_key)
     return ec2_resource, iam_client, redshift_client
 
+def count_api_calls(*clients):
+    """ Counts the API calls made by boto3 clients.
+    
+    Args:
+    clients: boto3 clients
+    
+    Returns:
+    counter (collections.Counter): number of calls by operation name, updated as the calls are made
+    """
+    counter = collections.Counter()
+    def on_call(model, **kwargs):
+        counter[model.name] += 1
+    for client in clients:
+        client.meta.events.register('before-call', on_call)
+    return counter
+
+def print_progress(step, status, elapsed):
+    """ Default handler of the progress events of provisioning steps.
+    
+    Args:
+    step (str): name of the step
+    status (str): 'started', 'completed', 'failed' or the status reported while waiting
+    elapsed (float): seconds since the start of the provisioning or of the wait
+    """
+    print('Time passed: {:05.1f} seconds, {}: {}'.format(elapsed, step, status))
+
+def wait_with_backoff(check, step, timeout=10.0, base_delay=1.0, max_delay=30.0, progress=print_progress):
+    """ Polls until a check succeeds, sleeping with exponential backoff and jitter between the polls,
+    so that a long wait takes a few API calls and concurrent waiters do not poll in lockstep.
+    
+    Args:
+    check (function): returns (done, status)
+    step (str): name of the step for the progress events
+    timeout (float): timeout value in minutes
+    base_delay (float): delay before the second poll in seconds
+    max_delay (float): maximum delay between polls in seconds
+    progress (function): handler of the progress events
+    
+    Returns:
+    status: the status returned by the successful check
+    
+    Raises:
+    TimeoutError: if the check does not succeed within the timeout, errors of the check are raised as they are
+    """
+    time_start = time.time()
+    attempt = 0
+    while True:
+        done, status = check()
+        elapsed = time.time() - time_start
+        progress(step, status, elapsed)
+        if done:
+            return status
+        if elapsed > timeout*60:
+            raise TimeoutError('WARNING: {} did not complete in {} minutes'.format(step, timeout))
+        delay = min(max_delay, base_delay * 2 ** attempt)
+        time.sleep(random.uniform(delay / 2, delay))
+        attempt += 1
+
 def check_iam_role_exists(iam_client, iam_role_name):
     """ Check if given IAM role exists.
     
@@ -89,7 +164,7 @@ def create_iam_role_with_policy(iam_client, iam_role_name, policy_arn):
 
 def launch_redshift_cluster(redshift_client, cluster_identifier,
                             cluster_type, node_type, num_nodes,
-                            db_name, db_user, db_password, iam_role_arn):
+                            db_name, db_user, db_password, iam_role_arn, security_group_ids=None):
     """ Launches a new Redshift cluster with provided cluster properties.
     
     Args:
@@ -102,82 +177,100 @@ def launch_redshift_cluster(redshift_client, cluster_identifier,
     db_user (str): master username
     db_password (str): master password
     iam_role_arn (str): IAM role for redshift cluster
+    security_group_ids (list): VPC security groups of the cluster, None for the default one
     """
-    if cluster_type == 'single-node':
-        response = redshift_client.create_cluster(        
-            # add parameters for hardware
-            ClusterType=cluster_type,
-            NodeType=node_type,
-            # add parameters for identifiers & credentials
-            DBName=db_name,
-            ClusterIdentifier=cluster_identifier,
-            MasterUsername=db_user,
-            MasterUserPassword=db_password,
-            # add parameter for IAM role
-            IamRoles=[iam_role_arn])
-    else:
-        response = redshift_client.create_cluster(        
-            # add parameters for hardware
-            ClusterType=cluster_type,
-            NodeType=node_type,
-            NumberOfNodes=num_nodes,
-            # add parameters for identifiers & credentials
-            DBName=db_name,
-            ClusterIdentifier=cluster_identifier,
-            MasterUsername=db_user,
-            MasterUserPassword=db_password,
-            # add parameter for IAM role
-            IamRoles=[iam_role_arn])
+    cluster_args = dict(
+        # add parameters for hardware
+        ClusterType=cluster_type,
+        NodeType=node_type,
+        # add parameters for identifiers & credentials
+        DBName=db_name,
+        ClusterIdentifier=cluster_identifier,
+        MasterUsername=db_user,
+        MasterUserPassword=db_password,
+        # add parameter for IAM role
+        IamRoles=[iam_role_arn])
+    if cluster_type != 'single-node':
+        cluster_args['NumberOfNodes'] = num_nodes
+    if security_group_ids:
+        cluster_args['VpcSecurityGroupIds'] = security_group_ids
+    redshift_client.create_cluster(**cluster_args)
     print('The request for launching Redshift cluster is successfully submitted')
 
-def wait_for_cluster_status_available(redshift_client, cluster_identifier, timeout=10.0):
-    """ Checks and waits for Redshift cluster to become available until timeout.
+def open_cluster_port(ec2_client, db_port):
+    """ Opens an incoming TCP port in the default security group of the default VPC.
+    
+    Args:
+    ec2_client (boto3 EC2 client)
+    db_port (int): port of the cluster endpoint
+    
+    Returns:
+    security_group_id (str): id of the security group
+    """
+    vpc_id = ec2_client.describe_vpcs(Filters=[{'Name': 'isDefault', 'Values': ['true']}])['Vpcs'][0]['VpcId']
+    security_group = ec2_client.describe_security_groups(
+        Filters=[{'Name': 'vpc-id', 'Values': [vpc_id]},
+                 {'Name': 'group-name', 'Values': ['default']}])['SecurityGroups'][0]
+    try:
+        ec2_client.authorize_security_group_ingress(
+            GroupId=security_group['GroupId'],
+            IpPermissions=[{'IpProtocol': 'tcp', 'FromPort': db_port, 'ToPort': db_port,
+                            'IpRanges': [{'CidrIp': '0.0.0.0/0'}]}])
+    except Exception as e:
+        if 'InvalidPermission.Duplicate' not in str(e):
+            raise
+        print('TCP port access rule already exists for the default security group')
+    return security_group['GroupId']
+
+def get_cluster_status(redshift_client, cluster_identifier):
+    """ Returns the properties of the cluster, None if it is not found. """
+    try:
+        return redshift_client.describe_clusters(ClusterIdentifier=cluster_identifier)['Clusters'][0]
+    except redshift_client.exceptions.ClusterNotFoundFault:
+        return None
+
+def wait_for_cluster_status_available(redshift_client, cluster_identifier, timeout=10.0, progress=print_progress):
+    """ Checks and waits for Redshift cluster to become available until timeout, polling with backoff.
     
     Args:
     redshift_client (boto3 Redshift client)
     cluster_identifier (str): Cluster identifier
     timeout (float): timeout value in minutes 
+    progress (function): handler of the progress events
+    
+    Returns:
+    cluster_props (dict): properties of the available cluster
     """
-    sleep_period = 2
-    timeout_seconds = timeout*60
-    time_start = time.time()
-    time_pass = time.time() - time_start
-    while time_pass < timeout_seconds:
-        try:
-            cluster_props = redshift_client.describe_clusters(ClusterIdentifier=cluster_identifier)['Clusters'][0]
-            if cluster_props['ClusterStatus'] == 'available':
-                print('Time passed: {:05.1f} seconds, Redshift cluster is now available for use'.format(time_pass))
-                return cluster_props
-            else:
-                print('Time passed: {:05.1f} seconds, Redshift cluster status: \'{}\''.format(time_pass, cluster_props['ClusterStatus']))
-        except redshift_client.exceptions.ClusterNotFoundFault:
-            print('Time passed: {:05.1f} seconds, Redshift cluster is not found yet ...'.format(time_pass))
-        time.sleep(sleep_period)
-        time_pass = time.time() - time_start
-    raise Exception('WARNING: Redshift cluster did not become available, please delete it on AWS web console and try again.')
-
-def create_cluster(config, ec2_resource, iam_client, redshift_client):
-    """ Creates the IAM role, launches Redshift Cluster and opens an incoming TCP access port.
+    cluster = {}
+    def check():
+        cluster['props'] = get_cluster_status(redshift_client, cluster_identifier)
+        if cluster['props'] is None:
+            return False, 'not found yet'
+        return cluster['props']['ClusterStatus'] == 'available', cluster['props']['ClusterStatus']
+    try:
+        wait_with_backoff(check, 'Redshift cluster', timeout=timeout, progress=progress)
+    except TimeoutError as e:
+        raise TimeoutError('WARNING: Redshift cluster did not become available in {} minutes, '
+                           'please delete it on AWS web console and try again.'.format(timeout)) from e
+    except Exception as e:
+        # errors of the status checks, such as denied access or throttling, are not reported as a timeout
+        raise Exception('Status of Redshift cluster could not be checked: {}'.format(e)) from e
+    return cluster['props']
+
+def create_cluster(config, ec2_resource, iam_client, redshift_client, progress=print_progress):
+    """ Creates the IAM role and opens an incoming TCP access port at the same time,
+    then launches Redshift Cluster and waits until it is available.
     
     Args:
     config: configuration for AWS/S3/Redshift cluster/IAM role
     ec2_resource (boto3 EC2 resource)
     iam_client (boto3 IAM client)
     redshift_client (boto3 Redshift client)
+    progress (function): handler of the progress events
     """
     # Get IAM role name and its policy
     iam_role_name = config.get('IAM_ROLE','role_name')
     policy_arn = config.get('IAM_ROLE','policy_arn')
-    # create IAM role for redshift to provide S3 read only access
-    try:
-        create_iam_role_with_policy(iam_client, iam_role_name, policy_arn)
-    except Exception as e:
-        print('IAM role (RoleName={}) could not be created\n{}'.format(iam_role_name, e))
-        return
-    # Update the IAM role ARN in the config file
-    iam_role_arn = iam_client.get_role(RoleName=iam_role_name)['Role']['Arn']
-    config.set('IAM_ROLE', 'arn', "'{}'".format(iam_role_arn))
-
     # Get Cluster/Database properties
     cluster_type = config.get('CLUSTER_PROP','cp_cluster_type')
     node_type = config.get('CLUSTER_PROP','cp_node_type')
@@ -186,57 +279,53 @@ def create_cluster(config, ec2_resource, iam_client, redshift_client):
     db_name = config.get('CLUSTER','db_name')
     db_user = config.get('CLUSTER','db_user')
     db_password = config.get('CLUSTER','db_password')
-    # Launch Redshift cluster
-    try:
+    db_port = config.get('CLUSTER','db_port')
+
+    def create_iam_role(inputs):
+        # create IAM role for redshift to provide S3 read only access
+        create_iam_role_with_policy(iam_client, iam_role_name, policy_arn)
+        return iam_client.get_role(RoleName=iam_role_name)['Role']['Arn']
+
+    def create_security_group_rule(inputs):
+        # Open an incoming TCP port to access the cluster endpoint
+        return open_cluster_port(ec2_resource.meta.client, int(db_port))
+
+    def launch_cluster(inputs):
         launch_redshift_cluster(redshift_client, cluster_identifier,
                                 cluster_type, node_type, int(num_nodes),
-                                db_name, db_user, db_password, iam_role_arn)
-    except Exception as e:
-        print(e)
-        return
-    # Wait Redshift cluster
+                                db_name, db_user, db_password, inputs['iam_role'],
+                                security_group_ids=[inputs['security_group']])
+
+    def wait_cluster(inputs):
+        return wait_for_cluster_status_available(redshift_client, cluster_identifier, progress=progress)
+
+    steps = {'iam_role': create_iam_role, 'security_group': create_security_group_rule,
+             'launch_cluster': launch_cluster, 'cluster_available': wait_cluster}
+    dependencies = {'launch_cluster': ['iam_role', 'security_group'], 'cluster_available': ['launch_cluster']}
     try:
-        cluster_props = wait_for_cluster_status_available(redshift_client, cluster_identifier)
+        results = run_dag(list(steps), dependencies, lambda name, inputs: steps[name](inputs), progress=progress)
     except Exception as e:
-        print(e)
+        print('Redshift cluster could not be created\n{}'.format(e))
         return
 
-    # Update clsuter host in the config file
-    db_host = cluster_props['Endpoint']['Address']
+    # Update the IAM role ARN and the cluster host in the config file
+    config.set('IAM_ROLE', 'arn', "'{}'".format(results['iam_role']))
+    db_host = results['cluster_available']['Endpoint']['Address']
     config.set('CLUSTER', 'host', db_host)
     print('The cluster endpoint adress: {}'.format(db_host))
     # Save the update config file for later use
     with open(config_filename, 'w') as configfile:
         config.write(configfile)
-
-    # Open an incoming TCP port to access the cluster endpoint
-    print('Creating an incoming TCP port to access the cluster endpoint...')
-    db_port = config.get('CLUSTER','db_port')
-    try:
-        vpc = ec2_resource.Vpc(id=cluster_props['VpcId'])
-        defaultSg = list(vpc.security_groups.all())[0]
-        print(defaultSg)
-
-        defaultSg.authorize_ingress(
-            GroupName= defaultSg.group_name,
-            CidrIp='0.0.0.0/0', 
-            IpProtocol='TCP',
-            FromPort=int(db_port),
-            ToPort=int(db_port))
-    except Exception as e:
-        if 'InvalidPermission.Duplicate' in str(e):
-            print('TCP port access rule already exists for the default security group')
-        else:
-            print(e)
-            return
     print('Redshift cluster setup is now completed succesfully and ready for use')
 
-def delete_cluster(config, redshift_client):
+def delete_cluster(config, redshift_client, timeout=10.0, progress=print_progress):
     """ Deletes Redshift cluster with given identifier.
     
     Args:
     config: configuration for AWS/S3/Redshift cluster/IAM role
     redshift_client (boto3 Redshift client)
+    timeout (float): timeout value in minutes
+    progress (function): handler of the progress events
     """
     # Get the cluster idenfier
     cluster_identifier = config.get('CLUSTER_PROP','cp_cluster_identifier')
@@ -256,22 +345,16 @@ def delete_cluster(config, redshift_client):
         return
 
     # Check cluster status until it is deleted
-    deleted = False
-    sleep_period = 2
-    time_start = time.time()
-    time_pass = time.time() - time_start
-    while deleted == False:
-        try:
-            cluster_props = redshift_client.describe_clusters(ClusterIdentifier=cluster_identifier)['Clusters'][0]
-            print('Time passed: {:05.1f} seconds, status of the Redshift cluster: \'{}\''.format(time_pass, cluster_props['ClusterStatus']))
-        except redshift_client.exceptions.ClusterNotFoundFault:
-            print('Time passed: {:05.1f} seconds, the redshift cluster is now successfully deleted'.format(time_pass))
-            deleted = True
-        except Exception as e:
-            print(e)
-            return
-        time.sleep(sleep_period)
-        time_pass = time.time() - time_start
+    def check():
+        cluster_props = get_cluster_status(redshift_client, cluster_identifier)
+        if cluster_props is None:
+            return True, 'deleted'
+        return False, cluster_props['ClusterStatus']
+    try:
+        wait_with_backoff(check, 'Redshift cluster', timeout=timeout, progress=progress)
+        print('The redshift cluster is now successfully deleted')
+    except Exception as e:
+        print(e)
 
 def describe_cluster(config, redshift_client):
     """ Checks and reports cluster status and its endpoint adress
@@ -295,12 +378,130 @@ def describe_cluster(config, redshift_client):
     except Exception as e:
         print(e)
 
-def main(action):
+def get_input_size(config, endpoint_url=None):
+    """ Lists the data files of the staging tables under the S3 prefixes of the configuration.
+    
+    Args:
+    config: configuration for AWS/S3/Redshift cluster/IAM role
+    endpoint_url (str): endpoint of a local AWS stand-in such as moto server, None for AWS
+    
+    Returns:
+    num_files (int): number of data files
+    num_bytes (int): total size of the data files in bytes
+    """
+    s3_client = create_s3_client(config, endpoint_url)
+    files = list_s3_files(s3_client, config.get('S3','log_data')) + list_s3_files(s3_client, config.get('S3','song_data'))
+    return len(files), sum(size for url, size in files)
+
+def load_cost(num_files, num_bytes):
+    """ Returns the amount of work of a load in bytes, counting the overhead of each file. """
+    return num_bytes + num_files * file_overhead_bytes
+
+def estimate_slice_throughput(history_file):
+    """ Estimates the bytes loaded per second by a slice from the loads on Redshift recorded by etl.py.
+    
+    Args:
+    history_file (str): JSON file of the load history
+    
+    Returns:
+    throughput (float): median bytes per second of a slice, None without recorded loads
+    num_loads (int): number of recorded loads used
+    """
+    try:
+        with open(history_file) as f:
+            history = json.load(f)
+    except FileNotFoundError:
+        return None, 0
+    throughputs = []
+    for load in history:
+        # older load histories also hold the loads on the local stand-in
+        if load.get('local') or load['seconds'] <= 0:
+            continue
+        # a slice loads one file at a time, so slices beyond the number of files are idle
+        busy_slices = max(1, min(load['num_slices'], load['files']))
+        throughputs.append(load_cost(load['files'], load['bytes']) / load['seconds'] / busy_slices)
+    if not throughputs:
+        return None, 0
+    throughputs.sort()
+    return throughputs[len(throughputs) // 2], len(throughputs)
+
+def recommend_cluster(num_files, num_bytes, throughput, target_minutes):
+    """ Estimates the load time of every node type and number of nodes and picks the cheapest cluster that meets the target.
+    
+    Args:
+    num_files (int): number of data files
+    num_bytes (int): total size of the data files in bytes
+    throughput (float): bytes loaded per second by a slice
+    target_minutes (float): target load time in minutes
+    
+    Returns:
+    recommendation (dict): node type, number of nodes, estimated load minutes and price per hour,
+                           the fastest cluster if none meets the target
+    candidates (list): the cheapest cluster of each node type that meets the target
+    """
+    estimates = []
+    for node_type, spec in node_types.items():
+        for num_nodes in range(spec['min_nodes'], spec['max_nodes'] + 1):
+            busy_slices = max(1, min(num_nodes * spec['slices'], num_files))
+            estimates.append({'node_type': node_type,
+                              'num_nodes': num_nodes,
+                              'minutes': load_cost(num_files, num_bytes) / throughput / busy_slices / 60,
+                              'price': num_nodes * spec['price']})
+    meets_target = sorted([e for e in estimates if e['minutes'] <= target_minutes], key=lambda e: (e['price'], e['minutes']))
+    candidates = [next(e for e in meets_target if e['node_type'] == node_type)
+                  for node_type in node_types if any(e['node_type'] == node_type for e in meets_target)]
+    if meets_target:
+        return meets_target[0], candidates
+    return min(estimates, key=lambda e: (e['minutes'], e['price'])), candidates
+
+def plan_cluster(config, target_minutes, history_file='load_history.json', write_config=False, endpoint_url=None):
+    """ Recommends the node type and the number of nodes of Redshift cluster for a target load time,
+    from the size of the S3 input and the load times recorded by etl.py.
+    
+    Args:
+    config: configuration for AWS/S3/Redshift cluster/IAM role
+    target_minutes (float): target load time in minutes
+    history_file (str): JSON file of the load history
+    write_config (bool): Write the recommendation to the config file for 'create'
+    endpoint_url (str): endpoint of a local AWS stand-in such as moto server, None for AWS
+    """
+    num_files, num_bytes = get_input_size(config, endpoint_url)
+    print('S3 input: {} files, {:.1f} MB'.format(num_files, num_bytes / 1024**2))
+    throughput, num_loads = estimate_slice_throughput(history_file)
+    if throughput is None:
+        throughput = default_slice_throughput
+        print('No Redshift load is recorded in {}, assuming {:.1f} MB per second per slice'.format(history_file, throughput / 1024**2))
+    else:
+        print('{} recorded loads in {}: {:.1f} MB per second per slice'.format(num_loads, history_file, throughput / 1024**2))
+
+    recommendation, candidates = recommend_cluster(num_files, num_bytes, throughput, target_minutes)
+    for candidate in candidates:
+        print('  {:<13} x{:<3} {:7.1f} minutes  ${:.2f} per hour'.format(candidate['node_type'], candidate['num_nodes'],
+                                                                        candidate['minutes'], candidate['price']))
+    if recommendation['minutes'] > target_minutes:
+        print('WARNING: no cluster loads the data in {} minutes, the fastest one is recommended'.format(target_minutes))
+    print('Recommended cluster: {} x{}, about {:.1f} minutes to load, ${:.2f} per hour'.format(
+          recommendation['node_type'], recommendation['num_nodes'], recommendation['minutes'], recommendation['price']))
+
+    if write_config:
+        config.set('CLUSTER_PROP', 'cp_cluster_type', 'single-node' if recommendation['num_nodes'] == 1 else 'multi-node')
+        config.set('CLUSTER_PROP', 'cp_node_type', recommendation['node_type'])
+        config.set('CLUSTER_PROP', 'cp_num_nodes', str(recommendation['num_nodes']))
+        with open(config_filename, 'w') as configfile:
+            config.write(configfile)
+        print('The recommendation is saved to {}, run \'create\' to launch the cluster'.format(config_filename))
+
+def main(args):
     """ Performs the selected action using boto3 library
     
     Args:
-    action (str): options are 'create', 'delete', 'describe'
+    args.action (str): options are 'create', 'delete', 'describe', 'plan'
+    args.endpoint_url (str): endpoint of a local AWS stand-in such as moto server, None for AWS
+    args.target_minutes (float): target load time of 'plan' in minutes
+    args.history (str): JSON file of the load history written by etl.py
+    args.write_config (bool): Write the recommendation of 'plan' to the config file
     """
+    action = args.action
     # Parse the configuratin file
     config = configparser.ConfigParser()
     config.read(config_filename)
@@ -311,31 +512,40 @@ def main(action):
     region_name = config.get('AWS','REGION')
     # create boto3 clients required for cluster setup
     try:
-        ec2_resource, iam_client, redshift_client = create_clients(access_key_id, secret_access_key, region_name)
+        ec2_resource, iam_client, redshift_client = create_clients(access_key_id, secret_access_key, region_name, args.endpoint_url)
     except Exception as e:
         print('AWS boto3 clients could not be initialized !\n{}'.format(e))
         return
+    api_calls = count_api_calls(ec2_resource.meta.client, iam_client, redshift_client)
 
+    time_start = time.time()
     if action == 'create':
         create_cluster(config, ec2_resource, iam_client, redshift_client)
     elif action == 'delete':
         delete_cluster(config, redshift_client)
     elif action == 'describe':
         describe_cluster(config, redshift_client)
+    elif action == 'plan':
+        plan_cluster(config, args.target_minutes, history_file=args.history,
+                     write_config=args.write_config, endpoint_url=args.endpoint_url)
+    print('{} completed in {:.1f} seconds with {} AWS API calls'.format(action.capitalize(), time.time() - time_start,
+                                                                       sum(api_calls.values())))
 
 if __name__ == "__main__":
     # Parse arguments
     parser = argparse.ArgumentParser(description="A python script to manage AWS Redshift Clusters through SDKs", add_help=True)
-    parser.add_argument("action", type=str, choices=['create', 'delete', 'describe'],
+    parser.add_argument("action", type=str, choices=['create', 'delete', 'describe', 'plan'],
                         help="""create: creates the Redshift cluster,
                                 delete: deletes the Redshift cluster,
-                                describe: reports status of the Redshift cluster
+                                describe: reports status of the Redshift cluster,
+                                plan: recommends the node type and number of nodes for a target load time
                              """)
+    parser.add_argument("--endpoint-url", help="Endpoint of a local AWS stand-in such as moto server, e.g. http://127.0.0.1:5000")
+    parser.add_argument("--target-minutes", type=float, default=10.0, help="Target load time of the staging tables in minutes for 'plan'")
+    parser.add_argument("--history", default='load_history.json', help="JSON file of the load history written by etl.py")
+    parser.add_argument("--write-config", help="Write the recommendation of 'plan' to the config file", action="store_true")
     args = parser.parse_args()
     # Configuration filename
     config_filename = 'dwh.cfg'
     # Call main function
-    main(args.action)
-    
-    
-    
\ No newline at end of file
+    main(args)
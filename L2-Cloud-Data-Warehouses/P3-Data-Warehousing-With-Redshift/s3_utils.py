@@ -0,0 +1,32 @@
+import boto3
+
+def create_s3_client(config, endpoint_url=None):
+    """ Creates boto3 client for S3 with the AWS credentials in the configuration.
+
+    Args:
+    config: configuration for AWS/S3/Redshift cluster/IAM role
+    endpoint_url (str): endpoint of a local AWS stand-in such as moto server, None for AWS
+
+    Returns:
+    s3_client: boto3 client for S3
+    """
+    return boto3.client('s3', region_name=config.get('AWS', 'REGION'), endpoint_url=endpoint_url,
+                        aws_access_key_id=config.get('AWS', 'KEY'), aws_secret_access_key=config.get('AWS', 'SECRET'))
+
+def list_s3_files(s3_client, s3_url):
+    """ Lists the files under an S3 prefix with their sizes.
+
+    Args:
+    s3_client (boto3 S3 client)
+    s3_url (str): S3 prefix such as 's3://udacity-dend/song_data'
+
+    Returns:
+    files (list): (url, size in bytes) pairs
+    """
+    bucket, prefix = s3_url.strip("'").replace('s3://', '').split('/', 1)
+    files = []
+    for page in s3_client.get_paginator('list_objects_v2').paginate(Bucket=bucket, Prefix=prefix):
+        for obj in page.get('Contents', []):
+            if obj['Size'] > 0 and obj['Key'].endswith('.json'):
+                files.append(('s3://{}/{}'.format(bucket, obj['Key']), obj['Size']))
+    return files
\ No newline at end of file
@@ -1,4 +1,5 @@
 import configparser
+import re
 
 # CONFIG
 config = configparser.ConfigParser()
@@ -8,6 +9,22 @@ s3_log_data_path = config.get('S3', 'log_data')
 s3_log_json_path = config.get('S3', 'log_jsonpath')
 s3_song_data_path = config.get('S3', 'song_data')
 
+# TABLE DESIGN
+# DISTSTYLE, DISTKEY and SORTKEY attributes of each table in the profile selected in [TABLE_DESIGN]
+table_design = {}
+if config.has_option('TABLE_DESIGN', 'profile'):
+    table_design = dict(config.items('PROFILE_{}'.format(config.get('TABLE_DESIGN', 'profile'))))
+table_attribute_pattern = r'(?:DISTSTYLE (?:ALL|EVEN|KEY|AUTO)|DISTKEY\(\w+\)|(?:(?:COMPOUND|INTERLEAVED) )?SORTKEY\(\w+(?:, ?\w+)*\))'
+
+def with_table_design(table, create_query):
+    """ Appends the table attributes of the selected profile, e.g. 'DISTKEY(song_id) SORTKEY(start_time)', to a CREATE TABLE query. """
+    attributes = ' '.join(table_design.get(table, '').split())
+    if not attributes:
+        return create_query
+    if not re.fullmatch(r'{0}(?: {0})*'.format(table_attribute_pattern), attributes, re.IGNORECASE):
+        raise ValueError('Invalid table attributes for {}: {}'.format(table, attributes))
+    return '{} {};'.format(create_query.rstrip().rstrip(';'), attributes)
+
 # DROP TABLES
 staging_events_table_drop = "DROP TABLE IF EXISTS stage_events"
 staging_songs_table_drop = "DROP TABLE IF EXISTS stage_songs"
@@ -16,6 +33,7 @@ user_table_drop = "DROP TABLE IF EXISTS users"
 song_table_drop = "DROP TABLE IF EXISTS songs"
 artist_table_drop = "DROP TABLE IF EXISTS artists"
 time_table_drop = "DROP TABLE IF EXISTS time"
+watermark_table_drop = "DROP TABLE IF EXISTS etl_watermark"
 
 # CREATE TABLES
 staging_events_table_create= ("CREATE TABLE IF NOT EXISTS stage_events \
@@ -91,6 +109,12 @@ time_table_create = ("CREATE TABLE IF NOT EXISTS time \
                       year smallint NOT NULL, \
                       weekday smallint NOT NULL);")
 
+# High-watermark of the incremental loads: the latest event ts merged into the star schema
+watermark_table_create = ("CREATE TABLE IF NOT EXISTS etl_watermark \
+                          (source varchar NOT NULL, \
+                           max_ts bigint NOT NULL, \
+                           loaded_at timestamp DEFAULT getdate());")
+
 # STAGING TABLES
 staging_events_copy = ("""copy stage_events from {}
                           iam_role {}
@@ -102,14 +126,42 @@ staging_songs_copy = ("""copy stage_songs from {}
                           json 'auto';
                       """).format(s3_song_data_path, iam_role_arn)
 
+# Staging COPY from a manifest file, the manifest url is formatted into the query per file group
+staging_events_manifest_copy = ("""copy stage_events from '{{}}'
+                                   iam_role {}
+                                   json {}
+                                   manifest;
+                                """).format(iam_role_arn, s3_log_json_path)
+
+staging_songs_manifest_copy = ("""copy stage_songs from '{{}}'
+                                  iam_role {}
+                                  json 'auto'
+                                  manifest;
+                               """).format(iam_role_arn)
+
+# Number of slices of the cluster, COPY loads one file per slice at a time
+num_slices_select = "SELECT COUNT(*) FROM stv_slices"
+num_nodes_select = "SELECT COUNT(DISTINCT node) FROM stv_slices"
+
 # FINAL TABLES
+# The latest state of each user is picked with a window function, ties on ts are broken by itemInSession
 user_table_insert = ("""INSERT INTO users (user_id, first_name, last_name, gender, level)
-                        SELECT userId, firstName, lastName, gender, level FROM stage_events
-                        WHERE concat(userId, ts) IN (SELECT concat(userId, MAX(ts)) FROM stage_events
-                                                     WHERE userId IS NOT NULL
-                                                     GROUP BY userId)
+                        SELECT userId, firstName, lastName, gender, level
+                        FROM (SELECT userId, firstName, lastName, gender, level,
+                                     ROW_NUMBER() OVER (PARTITION BY userId ORDER BY ts DESC, itemInSession DESC) AS user_row
+                              FROM stage_events
+                              WHERE userId IS NOT NULL) AS latest
+                        WHERE user_row = 1
                      """)
 
+# Previous version of the users load with a semi-join on concatenated strings, kept for comparison by compare_user_load.py
+user_table_insert_legacy = ("""INSERT INTO users (user_id, first_name, last_name, gender, level)
+                               SELECT userId, firstName, lastName, gender, level FROM stage_events
+                               WHERE concat(userId, ts) IN (SELECT concat(userId, MAX(ts)) FROM stage_events
+                                                            WHERE userId IS NOT NULL
+                                                            GROUP BY userId)
+                            """)
+
 time_table_insert = ("""INSERT INTO time (start_time, hour, day, week, month, year, weekday)
                         SELECT stage_ts.start_time,
                                EXTRACT(hour from stage_ts.start_time),
@@ -129,28 +181,241 @@ artist_table_insert = ("""INSERT INTO artists (artist_id, name, location, latitu
                           SELECT DISTINCT artist_id, artist_name, artist_location, artist_latitude, artist_longitude FROM stage_songs
                        """)
 
+# Songs with their artists deduplicated on (title, artist_name, duration), the key the events refer to a song by.
+# The song and artist ids of a key are taken from the same song, the one with the lowest song_id.
+# It is a temporary table, so it is created, used by the songplays insert and dropped on the same connection.
+song_lookup_create = ("""CREATE TEMP TABLE song_lookup SORTKEY(title, artist_name, duration) AS
+                         SELECT title, artist_name, duration, song_id, artist_id
+                         FROM (SELECT s.title, a.name AS artist_name, s.duration, s.song_id, s.artist_id,
+                                      ROW_NUMBER() OVER (PARTITION BY s.title, a.name, s.duration ORDER BY s.song_id) AS song_row
+                               FROM songs s
+                               JOIN artists a ON s.artist_id = a.artist_id) AS songs_by_key
+                         WHERE song_row = 1
+                      """)
+
+song_lookup_drop = "DROP TABLE IF EXISTS song_lookup"
+
 songplay_table_insert = ("""INSERT INTO songplays (start_time, user_id, level, song_id, artist_id, session_id, location, user_agent)
                             SELECT TIMESTAMP 'epoch' + e.ts/1000 * interval '1 second',
                                    e.userId,
                                    e.level,
-                                   s.song_id,
-                                   a.artist_id,
+                                   l.song_id,
+                                   l.artist_id,
                                    e.sessionId,
                                    e.location,
                                    e.userAgent
                             FROM stage_events e
-                            JOIN songs s ON e.song = s.title
-                            JOIN artists a ON e.artist = a.name
+                            JOIN song_lookup l ON e.song = l.title AND e.artist = l.artist_name AND e.length = l.duration
+                            WHERE e.page = 'NextSong' AND e.userId IS NOT NULL
+                         """)
+
+# Matched events and joined rows of the songplays join, before with the title and name joins and after with the lookup
+songplay_fanout_legacy_select = ("""SELECT COUNT(*), SUM(matches), MAX(matches)
+                                    FROM (SELECT e.userId, e.sessionId, e.itemInSession, COUNT(*) AS matches
+                                          FROM stage_events e
+                                          JOIN songs s ON e.song = s.title
+                                          JOIN artists a ON e.artist = a.name
+                                          WHERE e.page = 'NextSong' AND e.userId IS NOT NULL
+                                          GROUP BY e.userId, e.sessionId, e.itemInSession) AS events
+                                 """)
+
+songplay_fanout_select = ("""SELECT COUNT(*), SUM(matches), MAX(matches)
+                             FROM (SELECT e.userId, e.sessionId, e.itemInSession, COUNT(*) AS matches
+                                   FROM stage_events e
+                                   JOIN song_lookup l ON e.song = l.title AND e.artist = l.artist_name AND e.length = l.duration
+                                   WHERE e.page = 'NextSong' AND e.userId IS NOT NULL
+                                   GROUP BY e.userId, e.sessionId, e.itemInSession) AS events
+                          """)
+
+# INCREMENTAL LOAD
+# The staging tables hold only the new files and the events after the watermark are merged into the star schema
+# in a single transaction: the dimensions are updated and inserted on their keys (the rows are not deleted, as the
+# foreign keys of songplays refer to them), and songplays and the watermark are appended.
+staging_tables_truncate = ["TRUNCATE stage_events", "TRUNCATE stage_songs"]
+
+new_events_create = ("""CREATE TEMP TABLE new_events AS
+                        SELECT * FROM stage_events
+                        WHERE ts > (SELECT COALESCE(MAX(max_ts), -1) FROM etl_watermark WHERE source = 'stage_events')
+                     """)
+
+new_events_drop = "DROP TABLE IF EXISTS new_events"
+
+# Staged events at or before the watermark, late events that the merge leaves out
+late_events_select = ("""SELECT COUNT(*), SUM(CASE WHEN page = 'NextSong' THEN 1 ELSE 0 END) FROM stage_events
+                         WHERE ts <= (SELECT COALESCE(MAX(max_ts), -1) FROM etl_watermark WHERE source = 'stage_events')
+                      """)
+
+user_table_merge = ["""CREATE TEMP TABLE new_users AS
+                       SELECT userId, firstName, lastName, gender, level
+                       FROM (SELECT userId, firstName, lastName, gender, level,
+                                    ROW_NUMBER() OVER (PARTITION BY userId ORDER BY ts DESC, itemInSession DESC) AS user_row
+                             FROM new_events
+                             WHERE userId IS NOT NULL) AS latest
+                       WHERE user_row = 1
+                    """,
+                    """UPDATE users SET first_name = n.firstName, last_name = n.lastName, gender = n.gender, level = n.level
+                       FROM new_users n
+                       WHERE users.user_id = n.userId
+                    """,
+                    """INSERT INTO users (user_id, first_name, last_name, gender, level)
+                       SELECT userId, firstName, lastName, gender, level FROM new_users n
+                       WHERE NOT EXISTS (SELECT 1 FROM users u WHERE u.user_id = n.userId)
+                    """,
+                    "DROP TABLE new_users"]
+
+time_table_merge = ("""INSERT INTO time (start_time, hour, day, week, month, year, weekday)
+                       SELECT stage_ts.start_time,
+                              EXTRACT(hour from stage_ts.start_time),
+                              EXTRACT(day from stage_ts.start_time),
+                              EXTRACT(week from stage_ts.start_time),
+                              EXTRACT(month from stage_ts.start_time),
+                              EXTRACT(year from stage_ts.start_time),
+                              EXTRACT(dayofweek from stage_ts.start_time)
+                       FROM (SELECT DISTINCT TIMESTAMP 'epoch' + ts/1000 * interval '1 second' AS start_time FROM new_events) AS stage_ts
+                       WHERE NOT EXISTS (SELECT 1 FROM time t WHERE t.start_time = stage_ts.start_time)
+                    """)
+
+# stage_songs can hold a song in several files and an artist in many songs, so the songs and artists are deduplicated
+# on their keys first, otherwise the UPDATE takes an arbitrary row and the INSERT adds a key more than once.
+song_table_merge = ["""CREATE TEMP TABLE new_songs AS
+                       SELECT song_id, title, artist_id, year, duration
+                       FROM (SELECT song_id, title, artist_id, year, duration,
+                                    ROW_NUMBER() OVER (PARTITION BY song_id ORDER BY year DESC, title, artist_id, duration) AS song_row
+                             FROM stage_songs
+                             WHERE song_id IS NOT NULL) AS songs_by_id
+                       WHERE song_row = 1
+                    """,
+                    """UPDATE songs SET title = n.title, artist_id = n.artist_id, year = n.year, duration = n.duration
+                       FROM new_songs n
+                       WHERE songs.song_id = n.song_id
+                    """,
+                    """INSERT INTO songs (song_id, title, artist_id, year, duration)
+                       SELECT song_id, title, artist_id, year, duration FROM new_songs n
+                       WHERE NOT EXISTS (SELECT 1 FROM songs s WHERE s.song_id = n.song_id)
+                    """,
+                    "DROP TABLE new_songs"]
+
+# The row of an artist with a location is preferred over the rows without one
+artist_table_merge = ["""CREATE TEMP TABLE new_artists AS
+                         SELECT artist_id, artist_name, artist_location, artist_latitude, artist_longitude
+                         FROM (SELECT artist_id, artist_name, artist_location, artist_latitude, artist_longitude,
+                                      ROW_NUMBER() OVER (PARTITION BY artist_id
+                                                         ORDER BY artist_latitude NULLS LAST, artist_location NULLS LAST,
+                                                                  artist_name) AS artist_row
+                               FROM stage_songs
+                               WHERE artist_id IS NOT NULL) AS artists_by_id
+                         WHERE artist_row = 1
+                      """,
+                      """UPDATE artists SET name = n.artist_name, location = n.artist_location,
+                                           latitude = n.artist_latitude, longitude = n.artist_longitude
+                         FROM new_artists n
+                         WHERE artists.artist_id = n.artist_id
+                      """,
+                      """INSERT INTO artists (artist_id, name, location, latitude, longitude)
+                         SELECT artist_id, artist_name, artist_location, artist_latitude, artist_longitude FROM new_artists n
+                         WHERE NOT EXISTS (SELECT 1 FROM artists a WHERE a.artist_id = n.artist_id)
+                      """,
+                      "DROP TABLE new_artists"]
+
+songplay_table_append = ("""INSERT INTO songplays (start_time, user_id, level, song_id, artist_id, session_id, location, user_agent)
+                            SELECT TIMESTAMP 'epoch' + e.ts/1000 * interval '1 second',
+                                   e.userId,
+                                   e.level,
+                                   l.song_id,
+                                   l.artist_id,
+                                   e.sessionId,
+                                   e.location,
+                                   e.userAgent
+                            FROM new_events e
+                            JOIN song_lookup l ON e.song = l.title AND e.artist = l.artist_name AND e.length = l.duration
                             WHERE e.page = 'NextSong' AND e.userId IS NOT NULL
                          """)
 
+watermark_select = "SELECT MAX(max_ts) FROM etl_watermark WHERE source = 'stage_events'"
+
+watermark_update = ["""DELETE FROM etl_watermark
+                       WHERE source = 'stage_events' AND EXISTS (SELECT 1 FROM new_events)
+                    """,
+                    """INSERT INTO etl_watermark (source, max_ts)
+                       SELECT 'stage_events', MAX(ts) FROM new_events HAVING COUNT(*) > 0
+                    """]
+
+# INSTRUMENTATION
+# Id of the last query and rows loaded by the last COPY of the session
+last_query_id_select = "SELECT pg_last_query_id()"
+last_copy_count_select = "SELECT pg_last_copy_count()"
+
+# Rows rejected by the COPYs since the start of the run, including the COPYs that failed
+load_errors_select = ("""SELECT query, TRIM(filename), line_number, TRIM(colname), TRIM(type),
+                                TRIM(raw_field_value), err_code, TRIM(err_reason)
+                         FROM stl_load_errors
+                         WHERE starttime >= %s
+                         ORDER BY query, line_number
+                      """)
+
+# Steps of the recorded queries with their rows, bytes, time and whether they spilled to disk
+query_summary_select = ("""SELECT query, stm, seg, step, TRIM(label), rows, bytes, maxtime, is_diskbased
+                           FROM svl_query_summary
+                           WHERE query IN %s
+                           ORDER BY query, stm, seg, step
+                        """)
+
+# ANALYTICS QUERIES
+# Typical queries on the star schema, their plans are checked for redistribution of data by check_plans.py
+top_songs_select = ("""SELECT s.title, a.name, COUNT(*) AS plays
+                       FROM songplays sp
+                       JOIN songs s ON sp.song_id = s.song_id
+                       JOIN artists a ON sp.artist_id = a.artist_id
+                       GROUP BY s.title, a.name
+                       ORDER BY plays DESC
+                       LIMIT 10
+                    """)
+
+plays_by_hour_select = ("""SELECT t.hour, COUNT(*) AS plays
+                           FROM songplays sp
+                           JOIN time t ON sp.start_time = t.start_time
+                           WHERE sp.start_time BETWEEN '2018-11-01' AND '2018-11-30'
+                           GROUP BY t.hour
+                           ORDER BY t.hour
+                        """)
+
+plays_by_level_select = ("""SELECT u.level, u.gender, COUNT(*) AS plays
+                            FROM songplays sp
+                            JOIN users u ON sp.user_id = u.user_id
+                            GROUP BY u.level, u.gender
+                         """)
+
 # QUERY LISTS
-create_table_queries = [staging_events_table_create, staging_songs_table_create,
-                        user_table_create, time_table_create, song_table_create, artist_table_create, songplay_table_create]
+create_table_queries = [with_table_design('stage_events', staging_events_table_create),
+                        with_table_design('stage_songs', staging_songs_table_create),
+                        with_table_design('users', user_table_create),
+                        with_table_design('time', time_table_create),
+                        with_table_design('songs', song_table_create),
+                        with_table_design('artists', artist_table_create),
+                        with_table_design('songplays', songplay_table_create),
+                        watermark_table_create]
 
 drop_table_queries = [staging_events_table_drop, staging_songs_table_drop,
-                      songplay_table_drop, user_table_drop, time_table_drop, song_table_drop, artist_table_drop]
+                      songplay_table_drop, user_table_drop, time_table_drop, song_table_drop, artist_table_drop,
+                      watermark_table_drop]
 
 copy_table_queries = [staging_events_copy, staging_songs_copy]
 
-insert_table_queries = [user_table_insert, time_table_insert, song_table_insert, artist_table_insert, songplay_table_insert]
+songplay_table_steps = [song_lookup_drop, song_lookup_create, songplay_table_insert, song_lookup_drop]
+
+insert_table_queries = [user_table_insert, time_table_insert, song_table_insert, artist_table_insert] + songplay_table_steps
+
+# Insert queries by table and the tables each one reads besides the staging tables,
+# songplays looks up the song and artist ids in songs and artists with the queries run on one connection
+insert_table_steps = {'users': user_table_insert, 'time': time_table_insert, 'songs': song_table_insert,
+                      'artists': artist_table_insert, 'songplays': songplay_table_steps}
+insert_table_dependencies = {'users': [], 'time': [], 'songs': [], 'artists': [], 'songplays': ['songs', 'artists']}
+
+# Queries of the incremental merge by step, run in this order in one transaction
+merge_table_steps = {'new_events': [new_events_drop, new_events_create], 'users': user_table_merge,
+                     'time': [time_table_merge], 'songs': song_table_merge, 'artists': artist_table_merge,
+                     'songplays': [song_lookup_drop, song_lookup_create, songplay_table_append, song_lookup_drop],
+                     'watermark': watermark_update + [new_events_drop]}
+
+plan_check_queries = {'songplays insert': songplay_table_insert, 'top songs': top_songs_select,
+                      'plays by hour': plays_by_hour_select, 'plays by level': plays_by_level_select}
\ No newline at end of file